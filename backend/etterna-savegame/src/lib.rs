@@ -21,6 +21,22 @@ impl XmlData {
 		scores.sort_by_key(|score| score.datetime);
 		scores
 	}
+
+	/// Like [`Self::scores_chronologically`], but each score comes with the chart it was played on
+	pub fn scores_with_charts_chronologically(&self) -> Vec<(&Chart, &Score)> {
+		let mut scores = self
+			.player_scores
+			.charts
+			.iter()
+			.flat_map(|chart| {
+				chart.scores_at.iter().flat_map(move |scores_at| {
+					scores_at.scores.iter().map(move |score| (chart, score))
+				})
+			})
+			.collect::<Vec<_>>();
+		scores.sort_by_key(|(_, score)| score.datetime);
+		scores
+	}
 }
 
 #[derive(serde::Deserialize, Debug, Clone, PartialEq)]
@@ -31,6 +47,10 @@ pub struct PlayerScores {
 
 #[derive(serde::Deserialize, Debug, Clone, PartialEq)]
 pub struct Chart {
+	#[serde(rename = "Key")]
+	pub key: String,
+	#[serde(rename = "Pack", default)]
+	pub pack: String,
 	#[serde(rename = "ScoresAt", default)]
 	pub scores_at: Vec<ScoresAt>,
 }
@@ -43,6 +63,8 @@ pub struct ScoresAt {
 
 #[derive(serde::Deserialize, Debug, Clone, PartialEq)]
 pub struct Score {
+	#[serde(rename = "Key")]
+	pub key: String,
 	#[serde(rename = "SkillsetSSRs", default)]
 	#[serde(deserialize_with = "deserialize_xml_skillset_ssrs")]
 	pub ssr: Option<etterna::Skillsets8>,
@@ -29,6 +29,26 @@ impl pyo3::IntoPy<pyo3::PyObject> for DateTime {
 	}
 }
 
+impl<'source> pyo3::FromPyObject<'source> for DateTime {
+	fn extract(object: &'source pyo3::PyAny) -> pyo3::PyResult<Self> {
+		use pyo3::types::{PyDateAccess as _, PyTimeAccess as _};
+
+		let datetime = <pyo3::types::PyDateTime as pyo3::PyTryFrom>::try_from(object)?;
+		Ok(DateTime(
+			chrono::NaiveDate::from_ymd(
+				datetime.get_year(),
+				datetime.get_month() as u32,
+				datetime.get_day() as u32,
+			)
+			.and_hms(
+				datetime.get_hour() as u32,
+				datetime.get_minute() as u32,
+				datetime.get_second() as u32,
+			),
+		))
+	}
+}
+
 // Date is commented out because pyqtgraph can't handle raw dates, so better not use that
 /*#[derive(Debug, Clone, Copy, PartialEq, Eq, PartialOrd, Ord)]
 pub struct Date(pub chrono::NaiveDate);
@@ -7,8 +7,16 @@ mod datetime_hack;
 pub use datetime_hack::*;
 mod progress_callback;
 pub use progress_callback::*;
+mod rating_engine;
+pub use rating_engine::*;
 mod replays_analysis;
 pub use replays_analysis::*;
+mod rolling_stats;
+pub use rolling_stats::*;
+mod score_table;
+pub use score_table::*;
+mod time_aggregates;
+pub use time_aggregates::*;
 mod xml_stats;
 pub use xml_stats::*;
 
@@ -20,6 +28,31 @@ fn pythrow<E: std::fmt::Display>(error: E) -> pyo3::PyErr {
 	pyo3::exceptions::PyException::new_err(error.to_string())
 }
 
+/// Runs `worker(i, sender)` in a thread of its own for each `i` in `0..num_workers`, and returns
+/// the receiving end of what the workers send. Iterating the receiver ends when all workers are
+/// done. At most `capacity` messages are buffered, so workers that are faster than the receiver
+/// wait instead of piling up messages. If the receiver is dropped, loading was aborted and sending
+/// fails, which workers can use to stop early
+fn spawn_workers<T, F>(
+	num_workers: usize,
+	capacity: usize,
+	worker: F,
+) -> std::sync::mpsc::Receiver<T>
+where
+	T: Send + 'static,
+	F: Fn(usize, &std::sync::mpsc::SyncSender<T>) + Send + Sync + 'static,
+{
+	let worker = std::sync::Arc::new(worker);
+	let (sender, receiver) = std::sync::mpsc::sync_channel(capacity);
+	for i in 0..num_workers {
+		let sender = sender.clone();
+		let worker = std::sync::Arc::clone(&worker);
+		std::thread::spawn(move || worker(i, &sender));
+	}
+	// Our own sender is dropped here, so only the workers keep the channel open
+	receiver
+}
+
 #[pyclass]
 #[derive(serde::Deserialize, serde::Serialize, Debug, Clone, PartialEq)]
 pub struct Config {
@@ -163,15 +196,53 @@ fn backend(_py: Python, m: &PyModule) -> PyResult<()> {
 		})
 	}
 
+	#[pyfn(m, "load_xml_stats_multiple")]
+	pub fn load_xml_stats_multiple_py(
+		py: Python,
+		xml_paths: Vec<String>,
+		max_progress: PyObject,
+		progress: PyObject,
+		progress_text: PyObject,
+	) -> PyResult<Vec<XmlStats>> {
+		py.allow_threads(|| {
+			load_xml_stats_multiple(
+				&xml_paths,
+				ProgressHandler::new(max_progress, progress, progress_text),
+			)
+		})
+	}
+
+	#[pyfn(m, "update_xml_stats")]
+	pub fn update_xml_stats_py(
+		py: Python,
+		stats: &XmlStats,
+		max_progress: PyObject,
+		progress: PyObject,
+		progress_text: PyObject,
+	) -> PyResult<XmlStatsUpdate> {
+		py.allow_threads(|| {
+			update_xml_stats(
+				stats,
+				ProgressHandler::new(max_progress, progress, progress_text),
+			)
+		})
+	}
+
 	#[pyfn(m, "load_replays_analysis")]
 	pub fn load_replays_analysis_py(
 		py: Python,
+		replays_dir: PathBuf,
+		stats: &XmlStats,
 		max_progress: PyObject,
 		progress: PyObject,
-		progress_text: PyObject,
+		partial_results: PyObject,
 	) -> PyResult<ReplaysAnalysis> {
 		py.allow_threads(|| {
-			load_replays_analysis(ProgressHandler::new(max_progress, progress, progress_text))
+			load_replays_analysis(
+				&replays_dir,
+				stats,
+				ProgressHandler::new(max_progress, progress, partial_results),
+			)
 		})
 	}
 
@@ -218,6 +289,11 @@ fn backend(_py: Python, m: &PyModule) -> PyResult<()> {
 	m.add_class::<DetectedEtternaProfile>()?;
 	m.add_class::<Config>()?;
 	m.add_class::<AccRatingOverTime>()?;
+	m.add_class::<XmlStatsUpdate>()?;
+	m.add_class::<TimePyramid>()?;
+	m.add_class::<TimeAggregates>()?;
+	m.add_class::<RatingSnapshot>()?;
+	m.add_class::<RollingStats>()?;
 
 	Ok(())
 }
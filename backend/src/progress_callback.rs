@@ -68,4 +68,24 @@ impl ProgressCallback {
 		self.current_progress += 1;
 		Ok(())
 	}
+
+	/// Jump to the given progress value and hand intermediate results to the UI. The results are
+	/// emitted on the progress text signal, so this is for tasks whose third signal is connected to
+	/// something that expects the results instead of text
+	pub fn partial_result(
+		&mut self,
+		progress: u32,
+		partial_result: impl IntoPy<PyObject>,
+	) -> PyResult<()> {
+		Python::with_gil(|py| {
+			self.signals
+				.progress
+				.call_method1(py, "emit", (progress,))?;
+			self.signals
+				.progress_text
+				.call_method1(py, "emit", (partial_result.into_py(py),))
+		})?;
+		self.current_progress = progress;
+		Ok(())
+	}
 }
@@ -0,0 +1,510 @@
+/*!
+Incremental player rating calculation. Scores are fed in chronologically, and the best scores of
+each skillset are kept in ordered sets. That way, the rating can be read off at any point without
+replaying the whole score history again.
+
+Like in Etterna, only the best score on each chart (by overall SSR) counts. Each skillset rating is
+Etterna's skill aggregate of those scores' SSRs in that skillset, multiplied by 1.05 and clamped to
+0-100. The overall rating is the average of the six best skillset ratings
+*/
+
+use std::collections::{BTreeSet, HashSet};
+
+use pyo3::prelude::*;
+
+use crate::SECONDS_PER_DAY;
+
+/// Number of best scores per skillset that are listed in a [`RatingSnapshot`]
+pub const NUM_TOP_SCORES: usize = 250;
+
+/// (SSR bits, score index). SSRs are never negative, and the bit patterns of non-negative floats
+/// sort the same way as the floats themselves
+type Entry = (u32, u32);
+
+/// Best first
+fn iter_entries(entries: &BTreeSet<Entry>) -> impl Iterator<Item = (f32, u32)> + Clone + '_ {
+	(entries.iter().rev()).map(|&(ssr_bits, i)| (f32::from_bits(ssr_bits), i))
+}
+
+pub struct RatingEngine<'a> {
+	scores: &'a crate::ScoreTable,
+	/// The SSRs of the best score on each chart, for stream, jumpstream, handstream, stamina,
+	/// jackspeed, chordjack and technical
+	skillsets: Vec<BTreeSet<Entry>>,
+	/// Index of the best score on each chart so far
+	best_per_chart: Vec<Option<u32>>,
+	/// Cached rating. None if scores were added since
+	rating: Option<[f32; 8]>,
+}
+
+impl<'a> RatingEngine<'a> {
+	pub fn new(scores: &'a crate::ScoreTable) -> Self {
+		Self {
+			scores,
+			skillsets: vec![BTreeSet::new(); 7],
+			best_per_chart: vec![None; scores.charts.len()],
+			rating: None,
+		}
+	}
+
+	fn entry(&self, i: usize, skillset: usize) -> Entry {
+		// max() turns -0.0, whose bit pattern would sort wrong, into 0.0
+		(
+			self.scores.ssrs[i][skillset + 1].max(0.0).to_bits(),
+			i as u32,
+		)
+	}
+
+	/// Scores must be added in chronological order
+	pub fn add_score(&mut self, i: usize) {
+		if !self.scores.has_ssr(i) {
+			return;
+		}
+
+		let chart = self.scores.chart_indices[i] as usize;
+		if let Some(previous_best) = self.best_per_chart[chart] {
+			let previous_best = previous_best as usize;
+			if self.scores.ssrs[previous_best][0] >= self.scores.ssrs[i][0] {
+				return;
+			}
+			for skillset in 0..7 {
+				let entry = self.entry(previous_best, skillset);
+				self.skillsets[skillset].remove(&entry);
+			}
+		}
+
+		self.best_per_chart[chart] = Some(i as u32);
+		for skillset in 0..7 {
+			let entry = self.entry(i, skillset);
+			self.skillsets[skillset].insert(entry);
+		}
+		self.rating = None;
+	}
+
+	/// Returns overall and the seven skillset ratings. Cached until the next score is added
+	pub fn rating(&mut self) -> [f32; 8] {
+		let skillsets = &self.skillsets;
+		*self.rating.get_or_insert_with(|| {
+			let mut rating = [0.0; 8];
+			for (skillset, entries) in skillsets.iter().enumerate() {
+				let aggregate = aggregate_skill(iter_entries(entries).map(|(ssr, _)| ssr));
+				rating[skillset + 1] = (aggregate * 1.05).max(0.0).min(100.0);
+			}
+
+			let mut skillset_ratings = rating[1..].to_vec();
+			skillset_ratings.sort_by(|a, b| a.partial_cmp(b).unwrap_or(std::cmp::Ordering::Equal));
+			rating[0] = skillset_ratings[1..].iter().sum::<f32>() / 6.0;
+
+			rating
+		})
+	}
+
+	/// The best [`NUM_TOP_SCORES`] scores of the given skillset (0 = stream, 6 = technical), as
+	/// (SSR, score index). Best first
+	pub fn top_scores(&self, skillset: usize) -> impl Iterator<Item = (f32, u32)> + '_ {
+		iter_entries(&self.skillsets[skillset]).take(NUM_TOP_SCORES)
+	}
+}
+
+/// Etterna's skill aggregation. Finds the rating at which the summed up "excess" of the SSRs over
+/// the rating stops outgrowing 2^(rating / 10). `ssrs` must be sorted best first
+pub fn aggregate_skill(ssrs: impl Iterator<Item = f32> + Clone) -> f32 {
+	let mut rating = 0.0;
+	let mut resolution = 10.24;
+	for iteration in 1..=11 {
+		loop {
+			rating += resolution;
+			// SSRs at or below the rating contribute nothing, and those come last. Once the sum
+			// exceeds the threshold, the remaining SSRs can't change the outcome
+			let threshold = 2f64.powf(rating * 0.1);
+			let mut sum = 0.0;
+			for ssr in ssrs.clone().map(f64::from).take_while(|&ssr| ssr > rating) {
+				sum += 2.0 / erfc(0.1 * (ssr - rating)) - 2.0;
+				if sum > threshold {
+					break;
+				}
+			}
+			if threshold >= sum {
+				break;
+			}
+		}
+		if iteration == 11 {
+			break;
+		}
+		rating -= resolution;
+		resolution /= 2.0;
+	}
+	rating as f32
+}
+
+/// Complementary error function, with a fractional error below 1.2e-7 (Numerical Recipes'
+/// Chebyshev approximation)
+fn erfc(x: f64) -> f64 {
+	let z = x.abs();
+	let t = 1.0 / (1.0 + 0.5 * z);
+	let polynomial = -1.265_512_23
+		+ t * (1.000_023_68
+			+ t * (0.374_091_96
+				+ t * (0.096_784_18
+					+ t * (-0.186_288_06
+						+ t * (0.278_868_07
+							+ t * (-1.135_203_98
+								+ t * (1.488_515_87 + t * (-0.822_152_23 + t * 0.170_872_77))))))));
+	let result = t * (-z * z + polynomial).exp();
+	if x >= 0.0 {
+		result
+	} else {
+		2.0 - result
+	}
+}
+
+/// Restricts which scores are considered in a rating calculation
+#[derive(Debug, Clone, Default)]
+pub struct RatingFilter {
+	pub since: Option<crate::DateTime>,
+	pub until: Option<crate::DateTime>,
+	pub excluded_packs: Vec<String>,
+	/// If set, only scores on these charts are considered
+	pub chart_keys: Option<Vec<String>>,
+	/// If set, only scores with at least this wifescore (as a proportion) are considered
+	pub min_wifescore: Option<f32>,
+}
+
+impl RatingFilter {
+	/// Indices of the matching scores, in chronological order
+	fn matching_scores<'a>(
+		&self,
+		scores: &'a crate::ScoreTable,
+	) -> impl Iterator<Item = usize> + 'a {
+		let excluded_packs = self.excluded_packs.iter().collect::<HashSet<_>>();
+		let chart_keys = (self.chart_keys.as_ref()).map(|keys| keys.iter().collect::<HashSet<_>>());
+		let allowed_charts = (scores.charts.iter())
+			.map(|chart| {
+				!excluded_packs.contains(&chart.pack)
+					&& chart_keys
+						.as_ref()
+						.map_or(true, |keys| keys.contains(&chart.key))
+			})
+			.collect::<Vec<_>>();
+
+		let since = (self.since).map_or(0, |since| crate::clamped_timestamp(since.0));
+		let until = (self.until).map_or(u32::MAX, |until| crate::clamped_timestamp(until.0));
+
+		let min_wifescore = self.min_wifescore.unwrap_or(f32::NEG_INFINITY);
+		(0..scores.len()).filter(move |&i| {
+			(since..=until).contains(&scores.timestamps[i])
+				&& allowed_charts[scores.chart_indices[i] as usize]
+				&& scores.wifescores[i] >= min_wifescore
+		})
+	}
+}
+
+#[pyclass]
+#[derive(Debug, Clone, PartialEq)]
+pub struct RatingSnapshot {
+	/// Overall and the seven skillset ratings
+	#[pyo3(get)]
+	rating: [f32; 8],
+	/// For each of the seven skillsets, the best scores, at most [`NUM_TOP_SCORES`] of them. Each
+	/// score is (datetime, SSR in that skillset, chart key)
+	#[pyo3(get)]
+	top_scores: Vec<Vec<(crate::DateTime, f32, String)>>,
+}
+
+/// Rating after all scores matching the filter
+pub fn calculate_rating_snapshot(
+	scores: &crate::ScoreTable,
+	filter: &RatingFilter,
+) -> RatingSnapshot {
+	let mut engine = RatingEngine::new(scores);
+	for i in filter.matching_scores(scores) {
+		engine.add_score(i);
+	}
+
+	RatingSnapshot {
+		rating: engine.rating(),
+		top_scores: (0..7)
+			.map(|skillset| {
+				(engine.top_scores(skillset))
+					.map(|(ssr, i)| {
+						let i = i as usize;
+						let chart = &scores.charts[scores.chart_indices[i] as usize];
+						(scores.datetime(i), ssr, chart.key.clone())
+					})
+					.collect()
+			})
+			.collect(),
+	}
+}
+
+/// Rating over time of the scores matching the filter, with one entry for every day on which the
+/// rating changed
+pub fn calculate_rating_over_time(
+	scores: &crate::ScoreTable,
+	filter: &RatingFilter,
+) -> Vec<(crate::DateTime, [f32; 8])> {
+	let mut timeline = Vec::new();
+	extend_rating_over_time(
+		&mut RatingEngine::new(scores),
+		filter.matching_scores(scores),
+		&mut timeline,
+	);
+	timeline
+}
+
+/// Brings an unfiltered rating timeline up to date after scores were appended to the table.
+/// `timeline` must be the timeline of the scores before `first_new_score`. Feeding the older scores
+/// into the engine again is cheap, the rating itself is only calculated for the new days
+pub fn update_rating_over_time(
+	scores: &crate::ScoreTable,
+	timeline: &mut Vec<(crate::DateTime, [f32; 8])>,
+	first_new_score: usize,
+) {
+	let first_new_day = scores.timestamps[first_new_score] / SECONDS_PER_DAY;
+	let first_score_of_day = (scores.timestamps)
+		.partition_point(|&timestamp| timestamp / SECONDS_PER_DAY < first_new_day);
+
+	// The day of the first new score may already have an entry, which needs to be recalculated
+	let num_kept_entries = timeline.partition_point(|(datetime, _)| {
+		crate::clamped_timestamp(datetime.0) / SECONDS_PER_DAY < first_new_day
+	});
+	timeline.truncate(num_kept_entries);
+
+	let mut engine = RatingEngine::new(scores);
+	for i in 0..first_score_of_day {
+		engine.add_score(i);
+	}
+	extend_rating_over_time(&mut engine, first_score_of_day..scores.len(), timeline);
+}
+
+/// Adds the given scores, which must be chronological, and appends the rating after each day to
+/// `timeline` if it changed
+fn extend_rating_over_time(
+	engine: &mut RatingEngine,
+	score_indices: impl Iterator<Item = usize>,
+	timeline: &mut Vec<(crate::DateTime, [f32; 8])>,
+) {
+	let scores = engine.scores;
+	let mut record_day = |engine: &mut RatingEngine, day: u32| {
+		let rating = engine.rating();
+		if timeline.last().map(|&(_, last_rating)| last_rating) != Some(rating) {
+			timeline.push((
+				crate::datetime_from_timestamp(day * SECONDS_PER_DAY),
+				rating,
+			));
+		}
+	};
+
+	let mut current_day = None;
+	for i in score_indices {
+		let day = scores.timestamps[i] / SECONDS_PER_DAY;
+		if current_day != Some(day) {
+			if let Some(current_day) = current_day {
+				record_day(engine, current_day);
+			}
+			current_day = Some(day);
+		}
+		engine.add_score(i);
+	}
+	if let Some(current_day) = current_day {
+		record_day(engine, current_day);
+	}
+}
+
+#[cfg(test)]
+mod tests {
+	use super::*;
+
+	/// Deterministic pseudo random numbers in the range 0 to 1 (xorshift)
+	fn random_numbers(mut seed: u64) -> impl FnMut() -> f32 {
+		move || {
+			seed ^= seed << 13;
+			seed ^= seed >> 7;
+			seed ^= seed << 17;
+			(seed % 1_000_000) as f32 / 1_000_000.0
+		}
+	}
+
+	/// Scores spread over 60 days, on `num_charts` different charts
+	fn random_table(num_scores: usize, num_charts: usize) -> crate::ScoreTable {
+		let mut random = random_numbers(0x5eed);
+		let mut table = crate::ScoreTable {
+			charts: (0..num_charts)
+				.map(|i| crate::ChartInfo {
+					key: format!("X{}", i),
+					pack: format!("Pack {}", i % 3),
+				})
+				.collect(),
+			..Default::default()
+		};
+		for i in 0..num_scores {
+			table
+				.timestamps
+				.push(1_600_000_000 + (i * 60 * SECONDS_PER_DAY as usize / num_scores) as u32);
+			table.wifescores.push(0.9 + random() * 0.1);
+			let mut ssrs = [0.0; 8];
+			for ssr in &mut ssrs[1..] {
+				*ssr = 5.0 + random() * 25.0;
+			}
+			ssrs[0] = ssrs[1..].iter().cloned().fold(0.0, f32::max);
+			table.ssrs.push(ssrs);
+			table.key_hashes.push(i as u64);
+			table
+				.chart_indices
+				.push((random() * num_charts as f32) as u32 % num_charts as u32);
+		}
+		table
+	}
+
+	/// Straightforward port of Etterna's AggregateSSRs, without any shortcuts
+	fn naive_aggregate_skill(ssrs: &[f32]) -> f32 {
+		let mut rating = 0.0;
+		let mut resolution = 10.24;
+		for iteration in 1..=11 {
+			loop {
+				rating += resolution;
+				let sum: f64 = (ssrs.iter())
+					.map(|&ssr| (2.0 / erfc(0.1 * (ssr as f64 - rating)) - 2.0).max(0.0))
+					.sum();
+				if 2f64.powf(rating * 0.1) >= sum {
+					break;
+				}
+			}
+			if iteration == 11 {
+				break;
+			}
+			rating -= resolution;
+			resolution /= 2.0;
+		}
+		rating as f32
+	}
+
+	#[test]
+	fn erfc_matches_reference_values() {
+		for &(x, expected) in &[
+			(0.0, 1.0),
+			(0.5, 0.479_500_122_186_953_5),
+			(1.0, 0.157_299_207_050_285_1),
+			(-1.0, 1.842_700_792_949_715),
+			(2.0, 0.004_677_734_981_047_266),
+		] {
+			assert!(
+				((erfc(x) - expected) / expected).abs() < 1.2e-7,
+				"erfc({})",
+				x
+			);
+		}
+	}
+
+	#[test]
+	fn aggregate_skill_matches_naive_version() {
+		let mut random = random_numbers(42);
+		for &num_ssrs in &[0, 1, 5, 300, 2000] {
+			let mut ssrs = (0..num_ssrs).map(|_| random() * 35.0).collect::<Vec<_>>();
+			ssrs.sort_by(|a, b| b.partial_cmp(a).unwrap());
+			assert_eq!(
+				aggregate_skill(ssrs.iter().cloned()),
+				naive_aggregate_skill(&ssrs)
+			);
+		}
+	}
+
+	#[test]
+	fn engine_matches_recalculating_from_scratch() {
+		// Multiple scores per chart, so that best scores get superseded
+		let table = random_table(600, 150);
+		let filter = RatingFilter::default();
+		let timeline = calculate_rating_over_time(&table, &filter);
+
+		let mut expected_timeline: Vec<(crate::DateTime, [f32; 8])> = Vec::new();
+		for end in 1..=table.len() {
+			let day = table.timestamps[end - 1] / SECONDS_PER_DAY;
+			if end < table.len() && table.timestamps[end] / SECONDS_PER_DAY == day {
+				continue;
+			}
+
+			let mut best_per_chart: Vec<Option<usize>> = vec![None; table.charts.len()];
+			for i in 0..end {
+				let best = &mut best_per_chart[table.chart_indices[i] as usize];
+				if best.map_or(true, |best| table.ssrs[i][0] > table.ssrs[best][0]) {
+					*best = Some(i);
+				}
+			}
+			let mut rating = [0.0; 8];
+			for skillset in 1..8 {
+				let mut ssrs = (best_per_chart.iter().flatten())
+					.map(|&i| table.ssrs[i][skillset])
+					.collect::<Vec<_>>();
+				ssrs.sort_by(|a, b| b.partial_cmp(a).unwrap());
+				rating[skillset] = (naive_aggregate_skill(&ssrs) * 1.05).max(0.0).min(100.0);
+			}
+			let mut skillset_ratings = rating[1..].to_vec();
+			skillset_ratings.sort_by(|a, b| a.partial_cmp(b).unwrap());
+			rating[0] = skillset_ratings[1..].iter().sum::<f32>() / 6.0;
+
+			if expected_timeline.last().map(|&(_, last)| last) != Some(rating) {
+				let midnight = crate::datetime_from_timestamp(day * SECONDS_PER_DAY);
+				expected_timeline.push((midnight, rating));
+			}
+		}
+
+		assert_eq!(timeline, expected_timeline);
+	}
+
+	#[test]
+	fn update_matches_calculating_from_scratch() {
+		let table = random_table(600, 150);
+		let expected_timeline = calculate_rating_over_time(&table, &RatingFilter::default());
+
+		for &num_old_scores in &[1, 200, 401, 599] {
+			let mut old_table = table.clone();
+			old_table.timestamps.truncate(num_old_scores);
+			old_table.wifescores.truncate(num_old_scores);
+			old_table.ssrs.truncate(num_old_scores);
+			old_table.key_hashes.truncate(num_old_scores);
+			old_table.chart_indices.truncate(num_old_scores);
+
+			let mut timeline = calculate_rating_over_time(&old_table, &RatingFilter::default());
+			update_rating_over_time(&table, &mut timeline, num_old_scores);
+			assert_eq!(timeline, expected_timeline);
+		}
+	}
+
+	#[test]
+	fn unfiltered_rating_matches_etterna_skill_timeline() {
+		// One score per chart, because the skill timeline doesn't know about charts
+		let mut table = random_table(400, 400);
+		table.chart_indices = (0..table.len() as u32).collect();
+
+		let rating_over_time = calculate_rating_over_time(&table, &RatingFilter::default());
+		let skill_timeline = etterna::SkillTimeline::calculate(
+			(0..table.len()).map(|i| {
+				let midnight = table.timestamps[i] - table.timestamps[i] % SECONDS_PER_DAY;
+				let midnight = crate::datetime_from_timestamp(midnight);
+				let ssr = table.skillsets8(i).expect("all scores have SSRs");
+				(midnight, ssr.to_skillsets7())
+			}),
+			false,
+		);
+
+		assert_eq!(rating_over_time.len(), skill_timeline.changes.len());
+		for ((datetime, rating), (expected_datetime, expected_rating)) in
+			rating_over_time.iter().zip(&skill_timeline.changes)
+		{
+			assert_eq!(datetime, expected_datetime);
+			let expected_rating = [
+				expected_rating.overall,
+				expected_rating.stream,
+				expected_rating.jumpstream,
+				expected_rating.handstream,
+				expected_rating.stamina,
+				expected_rating.jackspeed,
+				expected_rating.chordjack,
+				expected_rating.technical,
+			];
+			for (value, expected_value) in rating.iter().zip(&expected_rating) {
+				assert!((value - expected_value).abs() < 0.01, "{:?}", datetime);
+			}
+		}
+	}
+}
@@ -1,15 +1,262 @@
+/*!
+Hit offset statistics over all replays in the ReplaysV2 folder. The replays are parsed by a few
+worker threads, each of which sums up its offsets into histograms. Every couple of replays, the
+workers hand their histograms over to be merged into the totals, and the totals are streamed to the
+UI so that the plots fill in while loading.
+
+Histograms have a fixed number of bins, so memory use doesn't grow with the number of replays, only
+with the number of days on which replays were played
+*/
+
+use std::collections::{BTreeMap, HashMap};
+use std::path::Path;
+
 use pyo3::prelude::*;
 
+use crate::{pythrow, SECONDS_PER_DAY};
+
+/// Offsets beyond this, in milliseconds, are misses
+const MISS_WINDOW_MS: f32 = 180.0;
+/// One bin per millisecond, from -180ms to 180ms
+const NUM_BINS: usize = 361;
+/// Number of replays a worker parses before handing its histograms over
+const REPLAYS_PER_BATCH: u32 = 50;
+/// Minimum time between two partial results sent to the UI
+const PARTIAL_RESULT_INTERVAL: std::time::Duration = std::time::Duration::from_millis(250);
+
+#[derive(Debug, Clone, PartialEq)]
+struct OffsetHistogram {
+	counts: Vec<u32>,
+}
+
+impl Default for OffsetHistogram {
+	fn default() -> Self {
+		Self {
+			counts: vec![0; NUM_BINS],
+		}
+	}
+}
+
+impl OffsetHistogram {
+	/// `offset_ms` must be within the miss window
+	fn add(&mut self, offset_ms: f32) {
+		let bin = (offset_ms + MISS_WINDOW_MS).round() as usize;
+		self.counts[bin.min(NUM_BINS - 1)] += 1;
+	}
+
+	fn merge(&mut self, other: &Self) {
+		for (count, other_count) in self.counts.iter_mut().zip(&other.counts) {
+			*count += other_count;
+		}
+	}
+
+	fn bin_center(bin: usize) -> f32 {
+		bin as f32 - MISS_WINDOW_MS
+	}
+
+	/// Nearest-rank percentile, accurate to the bin width. None if the histogram is empty
+	fn percentile(&self, p: f32) -> Option<f32> {
+		let total = self.counts.iter().map(|&count| count as u64).sum::<u64>();
+		if total == 0 {
+			return None;
+		}
+
+		let rank = ((total - 1) as f64 * p as f64).round() as u64;
+		let mut num_below = 0;
+		for (bin, &count) in self.counts.iter().enumerate() {
+			num_below += count as u64;
+			if num_below > rank {
+				return Some(Self::bin_center(bin));
+			}
+		}
+		unreachable!("rank is smaller than the total count")
+	}
+}
+
+/// Offsets of a part of the replays. Sums from different threads are merged into the totals
+#[derive(Debug, Clone, Default)]
+struct OffsetSums {
+	histogram: OffsetHistogram,
+	/// Keyed by days since the Unix epoch. Only contains replays whose score is in the Etterna.xml
+	daily_histograms: BTreeMap<u32, OffsetHistogram>,
+	num_misses: u64,
+	num_replays: u32,
+	num_unreadable_replays: u32,
+}
+
+impl OffsetSums {
+	/// `score_timestamps` maps key hashes of the scores in the Etterna.xml to their timestamps
+	fn add_replay(&mut self, path: &Path, score_timestamps: &HashMap<u64, u32>) {
+		let replay = match std::fs::read_to_string(path) {
+			Ok(replay) => replay,
+			Err(_) => {
+				self.num_unreadable_replays += 1;
+				return;
+			}
+		};
+
+		// Replays are named after the key of their score
+		let day = (path.file_name().and_then(|name| name.to_str()))
+			.and_then(|key| score_timestamps.get(&crate::hash_key(key)))
+			.map(|&timestamp| timestamp / SECONDS_PER_DAY);
+		let daily_histograms = &mut self.daily_histograms;
+		let mut daily_histogram = day.map(|day| daily_histograms.entry(day).or_default());
+
+		for offset_ms in replay.lines().filter_map(parse_offset_ms) {
+			if offset_ms.abs() > MISS_WINDOW_MS {
+				self.num_misses += 1;
+				continue;
+			}
+			self.histogram.add(offset_ms);
+			if let Some(daily_histogram) = &mut daily_histogram {
+				daily_histogram.add(offset_ms);
+			}
+		}
+		self.num_replays += 1;
+	}
+
+	fn merge(&mut self, other: &Self) {
+		self.histogram.merge(&other.histogram);
+		for (&day, histogram) in &other.daily_histograms {
+			self.daily_histograms
+				.entry(day)
+				.or_default()
+				.merge(histogram);
+		}
+		self.num_misses += other.num_misses;
+		self.num_replays += other.num_replays;
+		self.num_unreadable_replays += other.num_unreadable_replays;
+	}
+}
+
+/// Parses a line of a ReplaysV2 replay, which is `row offset column [note type [hold type]]`, with
+/// the offset in seconds. Returns the offset in milliseconds if the line is a tap
+fn parse_offset_ms(line: &str) -> Option<f32> {
+	// Lines with hold drops
+	if line.starts_with('H') {
+		return None;
+	}
+
+	let mut fields = line.split_whitespace();
+	let _row = fields.next()?;
+	let offset: f32 = fields.next()?.parse().ok()?;
+	let _column = fields.next()?;
+	// Plain taps don't have a note type. 1 is tap and 2 is hold head, the rest (mines, lifts,
+	// fakes...) aren't hit offsets
+	match fields.next() {
+		None | Some("1") | Some("2") => {}
+		Some(_) => return None,
+	}
+
+	let offset_ms = offset * 1000.0;
+	if offset_ms.is_finite() {
+		Some(offset_ms)
+	} else {
+		None
+	}
+}
+
 #[pyclass]
 #[derive(Debug, Clone, PartialEq)]
-pub struct ReplaysAnalysis {}
+pub struct ReplaysAnalysis {
+	/// (offset in milliseconds, number of hits), one entry per millisecond. Misses are left out
+	#[pyo3(get)]
+	offset_histogram: Vec<(f32, u32)>,
+	#[pyo3(get)]
+	num_misses: u64,
+	/// Number of replays analysed so far
+	#[pyo3(get)]
+	num_replays: u32,
+	#[pyo3(get)]
+	num_unreadable_replays: u32,
+	/// Daily percentiles of the hit offsets, in milliseconds
+	#[pyo3(get)]
+	offset_p25_over_time: Vec<(crate::DateTime, f32)>,
+	#[pyo3(get)]
+	offset_median_over_time: Vec<(crate::DateTime, f32)>,
+	#[pyo3(get)]
+	offset_p75_over_time: Vec<(crate::DateTime, f32)>,
+}
+
+impl ReplaysAnalysis {
+	fn from_sums(sums: &OffsetSums) -> Self {
+		let mut analysis = Self {
+			offset_histogram: (sums.histogram.counts.iter().enumerate())
+				.map(|(bin, &count)| (OffsetHistogram::bin_center(bin), count))
+				.collect(),
+			num_misses: sums.num_misses,
+			num_replays: sums.num_replays,
+			num_unreadable_replays: sums.num_unreadable_replays,
+			offset_p25_over_time: Vec::new(),
+			offset_median_over_time: Vec::new(),
+			offset_p75_over_time: Vec::new(),
+		};
 
-pub fn load_replays_analysis(progress: crate::ProgressHandler) -> PyResult<ReplaysAnalysis> {
-	const STEPS: u32 = 8;
-	let mut progress = progress.init(STEPS)?;
-	for i in 0..STEPS {
-		progress.step(&format!("We're now at number {}", i))?;
-		std::thread::sleep(std::time::Duration::from_millis(100));
+		for (&day, histogram) in &sums.daily_histograms {
+			let datetime = crate::datetime_from_timestamp(day * SECONDS_PER_DAY);
+			// Days with only misses have no percentiles
+			if let (Some(p25), Some(median), Some(p75)) = (
+				histogram.percentile(0.25),
+				histogram.percentile(0.5),
+				histogram.percentile(0.75),
+			) {
+				analysis.offset_p25_over_time.push((datetime, p25));
+				analysis.offset_median_over_time.push((datetime, median));
+				analysis.offset_p75_over_time.push((datetime, p75));
+			}
+		}
+
+		analysis
 	}
-	Ok(ReplaysAnalysis {})
+}
+
+/// Analyses all replays in `replays_dir`. Intermediate results are emitted on the progress text
+/// signal every now and then, see [`crate::ProgressCallback::partial_result`]
+pub fn load_replays_analysis(
+	replays_dir: &Path,
+	stats: &crate::XmlStats,
+	progress: crate::ProgressHandler,
+) -> PyResult<ReplaysAnalysis> {
+	let replay_paths = (std::fs::read_dir(replays_dir).map_err(pythrow)?)
+		.filter_map(|entry| Some(entry.ok()?.path()))
+		.filter(|path| path.is_file())
+		.collect::<Vec<_>>();
+	let mut progress = progress.init(replay_paths.len() as u32)?;
+
+	let scores = stats.scores();
+	let score_timestamps = (0..scores.len())
+		.map(|i| (scores.key_hashes[i], scores.timestamps[i]))
+		.collect::<HashMap<_, _>>();
+
+	let num_threads = std::thread::available_parallelism()
+		.map_or(4, |num_threads| num_threads.get())
+		.min(replay_paths.len())
+		.max(1);
+	let receiver = crate::spawn_workers(num_threads, num_threads, move |worker, sender| {
+		let mut sums = OffsetSums::default();
+		for path in replay_paths.iter().skip(worker).step_by(num_threads) {
+			sums.add_replay(path, &score_timestamps);
+			if sums.num_replays + sums.num_unreadable_replays >= REPLAYS_PER_BATCH
+				&& sender.send(std::mem::take(&mut sums)).is_err()
+			{
+				return;
+			}
+		}
+		let _ = sender.send(sums);
+	});
+
+	let mut totals = OffsetSums::default();
+	let mut last_partial_result = std::time::Instant::now();
+	for batch in receiver {
+		totals.merge(&batch);
+		if last_partial_result.elapsed() >= PARTIAL_RESULT_INTERVAL {
+			progress.partial_result(
+				totals.num_replays + totals.num_unreadable_replays,
+				ReplaysAnalysis::from_sums(&totals),
+			)?;
+			last_partial_result = std::time::Instant::now();
+		}
+	}
+
+	Ok(ReplaysAnalysis::from_sums(&totals))
 }
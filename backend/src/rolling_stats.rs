@@ -0,0 +1,271 @@
+/*!
+Rolling statistics over a chronological series, for trend lines. The window either spans a fixed
+number of scores or a fixed number of days, and ends at each score in turn
+*/
+
+use pyo3::prelude::*;
+
+use crate::SECONDS_PER_DAY;
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub enum RollingWindow {
+	Scores(usize),
+	Days(u32),
+}
+
+/// Each series has one point per score, at the end of the window
+#[pyclass]
+#[derive(Debug, Clone, PartialEq, Default)]
+pub struct RollingStats {
+	#[pyo3(get)]
+	mean: Vec<(crate::DateTime, f32)>,
+	#[pyo3(get)]
+	median: Vec<(crate::DateTime, f32)>,
+	#[pyo3(get)]
+	std_dev: Vec<(crate::DateTime, f32)>,
+	/// One series for each of the requested percentiles, in the same order
+	#[pyo3(get)]
+	percentiles: Vec<Vec<(crate::DateTime, f32)>>,
+}
+
+/// Multiset of values from a fixed domain that supports finding the k-th smallest value in
+/// O(log n). Implemented as a Fenwick tree over the ranks of the values
+struct OrderStatistics {
+	/// Count of present values, indexed by rank (1-based Fenwick layout)
+	tree: Vec<u32>,
+	/// The value of each rank
+	sorted_values: Vec<f32>,
+	/// The rank of each value, in the order the values were passed in
+	ranks: Vec<usize>,
+}
+
+impl OrderStatistics {
+	fn new(values: &[f32]) -> Self {
+		let mut order = (0..values.len()).collect::<Vec<_>>();
+		order.sort_by(|&a, &b| {
+			(values[a].partial_cmp(&values[b])).unwrap_or(std::cmp::Ordering::Equal)
+		});
+
+		// Every value gets a rank of its own, even if it's a duplicate
+		let mut ranks = vec![0; values.len()];
+		for (rank, &i) in order.iter().enumerate() {
+			ranks[i] = rank;
+		}
+
+		Self {
+			tree: vec![0; values.len() + 1],
+			sorted_values: order.iter().map(|&i| values[i]).collect(),
+			ranks,
+		}
+	}
+
+	fn update(&mut self, i: usize, delta: i32) {
+		let mut position = self.ranks[i] + 1;
+		while position < self.tree.len() {
+			self.tree[position] = (self.tree[position] as i32 + delta) as u32;
+			position += position & position.wrapping_neg();
+		}
+	}
+
+	/// Adds the value at index `i` of the original values
+	fn insert(&mut self, i: usize) {
+		self.update(i, 1);
+	}
+
+	/// Removes the value at index `i` of the original values
+	fn remove(&mut self, i: usize) {
+		self.update(i, -1);
+	}
+
+	/// Returns the k-th smallest of the present values, 0-based. `k` is clamped to the largest
+	/// value. `count` is the number of present values, which must be at least 1
+	fn kth_smallest(&self, k: u32, count: u32) -> f32 {
+		let mut k = k.min(count - 1);
+		let num_ranks = self.tree.len() - 1;
+		let mut position = 0;
+		let mut step = num_ranks.next_power_of_two();
+		while step > 0 {
+			if position + step <= num_ranks && self.tree[position + step] <= k {
+				position += step;
+				k -= self.tree[position];
+			}
+			step /= 2;
+		}
+		self.sorted_values[position]
+	}
+}
+
+/// `points` must be sorted chronologically, with timestamps in seconds. `percentiles` are in the
+/// range 0 to 1
+pub fn calculate_rolling_stats(
+	points: &[(u32, f32)],
+	window: RollingWindow,
+	percentiles: &[f32],
+) -> RollingStats {
+	let values = points.iter().map(|&(_, value)| value).collect::<Vec<_>>();
+	let mut order_statistics = OrderStatistics::new(&values);
+
+	let mut stats = RollingStats {
+		percentiles: vec![Vec::new(); percentiles.len()],
+		..Default::default()
+	};
+
+	let mut window_start = 0;
+	let mut sum = 0.0f64;
+	let mut sum_of_squares = 0.0f64;
+	for (i, &(timestamp, value)) in points.iter().enumerate() {
+		order_statistics.insert(i);
+		sum += value as f64;
+		sum_of_squares += value as f64 * value as f64;
+
+		loop {
+			let is_outside_window = match window {
+				RollingWindow::Scores(num_scores) => i - window_start >= num_scores,
+				RollingWindow::Days(num_days) => {
+					let window_length = num_days.saturating_mul(SECONDS_PER_DAY);
+					points[window_start].0.saturating_add(window_length) <= timestamp
+				}
+			};
+			// The window always keeps at least the current score
+			if window_start == i || !is_outside_window {
+				break;
+			}
+
+			let removed_value = values[window_start];
+			order_statistics.remove(window_start);
+			sum -= removed_value as f64;
+			sum_of_squares -= removed_value as f64 * removed_value as f64;
+			window_start += 1;
+		}
+
+		let len = (i - window_start + 1) as f64;
+		let mean = sum / len;
+		// max() guards against tiny negative values from floating point error
+		let variance = (sum_of_squares / len - mean * mean).max(0.0);
+		// Nearest-rank percentile
+		let percentile = |p: f32| {
+			order_statistics.kth_smallest(((len - 1.0) * p as f64).round() as u32, len as u32)
+		};
+
+		let datetime = crate::datetime_from_timestamp(timestamp);
+		stats.mean.push((datetime, mean as f32));
+		stats.median.push((datetime, percentile(0.5)));
+		stats.std_dev.push((datetime, variance.sqrt() as f32));
+		for (series, &p) in stats.percentiles.iter_mut().zip(percentiles) {
+			series.push((datetime, percentile(p)));
+		}
+	}
+
+	stats
+}
+
+#[cfg(test)]
+mod tests {
+	use super::*;
+
+	/// Deterministic pseudo random numbers in the range 0 to 1 (xorshift)
+	fn random_numbers(mut seed: u64) -> impl FnMut() -> f32 {
+		move || {
+			seed ^= seed << 13;
+			seed ^= seed >> 7;
+			seed ^= seed << 17;
+			(seed % 1_000_000) as f32 / 1_000_000.0
+		}
+	}
+
+	/// Chronological points with lots of duplicate values and several points per timestamp
+	fn random_points(num_points: usize) -> Vec<(u32, f32)> {
+		let mut random = random_numbers(0x5eed);
+		let mut timestamp = 1_600_000_000;
+		(0..num_points)
+			.map(|_| {
+				if random() < 0.7 {
+					timestamp += (random() * 2.0 * SECONDS_PER_DAY as f32) as u32;
+				}
+				(timestamp, (random() * 8.0).floor() / 2.0 + 90.0)
+			})
+			.collect()
+	}
+
+	/// Sorts the window anew for every point
+	fn naive_rolling_stats(
+		points: &[(u32, f32)],
+		window: RollingWindow,
+		percentiles: &[f32],
+	) -> Vec<(f64, f64, f32, Vec<f32>)> {
+		(0..points.len())
+			.map(|i| {
+				let window_start = match window {
+					RollingWindow::Scores(num_scores) => (i + 1).saturating_sub(num_scores),
+					RollingWindow::Days(num_days) => (0..i)
+						.find(|&j| {
+							points[j].0 as u64 + num_days as u64 * SECONDS_PER_DAY as u64
+								> points[i].0 as u64
+						})
+						.unwrap_or(i),
+				};
+				let mut values = (points[window_start..=i].iter())
+					.map(|&(_, value)| value)
+					.collect::<Vec<_>>();
+				values.sort_by(|a, b| a.partial_cmp(b).unwrap());
+
+				let len = values.len() as f64;
+				let mean = values.iter().map(|&value| value as f64).sum::<f64>() / len;
+				let variance = (values.iter())
+					.map(|&value| (value as f64 - mean).powi(2))
+					.sum::<f64>() / len;
+				let percentile = |p: f32| values[((len - 1.0) * p as f64).round() as usize];
+				(
+					mean,
+					variance.sqrt(),
+					percentile(0.5),
+					percentiles.iter().map(|&p| percentile(p)).collect(),
+				)
+			})
+			.collect()
+	}
+
+	#[test]
+	fn rolling_stats_match_sorting_each_window() {
+		let points = random_points(500);
+		let percentiles = [0.0, 0.1, 0.25, 0.75, 0.9, 1.0];
+		for &window in &[
+			RollingWindow::Scores(1),
+			RollingWindow::Scores(7),
+			RollingWindow::Scores(50),
+			RollingWindow::Scores(1000),
+			RollingWindow::Days(0),
+			RollingWindow::Days(1),
+			RollingWindow::Days(14),
+			RollingWindow::Days(u32::MAX),
+		] {
+			let stats = calculate_rolling_stats(&points, window, &percentiles);
+			let expected = naive_rolling_stats(&points, window, &percentiles);
+			assert_eq!(stats.mean.len(), points.len());
+			for (i, (mean, std_dev, median, expected_percentiles)) in expected.iter().enumerate() {
+				assert!(
+					(stats.mean[i].1 as f64 - mean).abs() < 1e-3,
+					"{:?} mean at {}",
+					window,
+					i
+				);
+				assert!(
+					(stats.std_dev[i].1 as f64 - std_dev).abs() < 1e-2,
+					"{:?} std dev at {}",
+					window,
+					i
+				);
+				assert_eq!(stats.median[i].1, *median, "{:?} median at {}", window, i);
+				for (series, &expected_percentile) in
+					stats.percentiles.iter().zip(expected_percentiles)
+				{
+					assert_eq!(
+						series[i].1, expected_percentile,
+						"{:?} percentile at {}",
+						window, i
+					);
+				}
+			}
+		}
+	}
+}
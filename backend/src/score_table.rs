@@ -0,0 +1,227 @@
+/*!
+Compact struct-of-arrays storage for all scores of a profile. Every statistic that needs per-score
+data is derived from this table, instead of keeping its own copy of the scores
+*/
+
+use std::collections::HashMap;
+use std::hash::{Hash as _, Hasher as _};
+
+pub const SECONDS_PER_DAY: u32 = 60 * 60 * 24;
+
+/// Indices into a [`ScoreTable`] of all scores with SSRs, grouped by grade
+#[derive(Debug, Clone, PartialEq, Default)]
+pub struct GradeBuckets {
+	pub aaaa_and_above: Vec<u32>,
+	pub aaa: Vec<u32>,
+	pub aa: Vec<u32>,
+	pub a: Vec<u32>,
+	pub b_and_below: Vec<u32>,
+}
+
+#[derive(Debug, Clone, PartialEq)]
+pub struct ChartInfo {
+	pub key: String,
+	pub pack: String,
+}
+
+/// All scores of a profile, sorted chronologically. Each score is stored as an index into the
+/// arrays
+#[derive(Debug, Clone, PartialEq, Default)]
+pub struct ScoreTable {
+	/// Seconds since the Unix epoch
+	pub timestamps: Vec<u32>,
+	/// J4-normalized wifescores, as proportions
+	pub wifescores: Vec<f32>,
+	/// SSRs in the order overall, stream, jumpstream, handstream, stamina, jackspeed, chordjack,
+	/// technical. All NaN if the score has no SSRs
+	pub ssrs: Vec<[f32; 8]>,
+	/// Hashes of the score keys, to recognize scores when the Etterna.xml is read again
+	pub key_hashes: Vec<u64>,
+	/// Index into `charts` of the chart each score was played on
+	pub chart_indices: Vec<u32>,
+	pub charts: Vec<ChartInfo>,
+	pub grades: GradeBuckets,
+}
+
+impl ScoreTable {
+	/// `scores` must be sorted chronologically
+	pub fn from_scores(scores: &[(&etterna_savegame::Chart, &etterna_savegame::Score)]) -> Self {
+		let mut table = Self {
+			timestamps: Vec::with_capacity(scores.len()),
+			wifescores: Vec::with_capacity(scores.len()),
+			ssrs: Vec::with_capacity(scores.len()),
+			key_hashes: Vec::with_capacity(scores.len()),
+			chart_indices: Vec::with_capacity(scores.len()),
+			charts: Vec::new(),
+			grades: GradeBuckets::default(),
+		};
+
+		let mut chart_indices = HashMap::new();
+		for (i, &(chart, score)) in scores.iter().enumerate() {
+			table.timestamps.push(clamped_timestamp(score.datetime));
+			table.wifescores.push(score.wifescore_j4.as_proportion());
+			table.ssrs.push(ssr_array(score));
+			table.key_hashes.push(hash_key(&score.key));
+
+			let charts = &mut table.charts;
+			let chart_index = *chart_indices.entry(&chart.key).or_insert_with(|| {
+				charts.push(ChartInfo {
+					key: chart.key.clone(),
+					pack: chart.pack.clone(),
+				});
+				charts.len() as u32 - 1
+			});
+			table.chart_indices.push(chart_index);
+
+			if score.ssr.is_some() {
+				let i = i as u32;
+				let wifescore = &score.wifescore_j4;
+				if *wifescore >= etterna::Wifescore::AAAA_THRESHOLD {
+					table.grades.aaaa_and_above.push(i);
+				} else if *wifescore >= etterna::Wifescore::AAA_THRESHOLD {
+					table.grades.aaa.push(i);
+				} else if *wifescore >= etterna::Wifescore::AA_THRESHOLD {
+					table.grades.aa.push(i);
+				} else if *wifescore >= etterna::Wifescore::A_THRESHOLD {
+					table.grades.a.push(i);
+				} else {
+					table.grades.b_and_below.push(i);
+				}
+			}
+		}
+
+		table
+	}
+
+	/// Appends the scores of `other`, which must not be older than the scores in this table
+	pub fn append(&mut self, other: &ScoreTable) {
+		let offset = self.len() as u32;
+
+		self.timestamps.extend_from_slice(&other.timestamps);
+		self.wifescores.extend_from_slice(&other.wifescores);
+		self.ssrs.extend_from_slice(&other.ssrs);
+		self.key_hashes.extend_from_slice(&other.key_hashes);
+
+		let mut chart_indices = (self.charts.iter().enumerate())
+			.map(|(i, chart)| (chart.key.clone(), i as u32))
+			.collect::<HashMap<_, _>>();
+		for &other_chart_index in &other.chart_indices {
+			let chart = &other.charts[other_chart_index as usize];
+			let charts = &mut self.charts;
+			let chart_index = *chart_indices.entry(chart.key.clone()).or_insert_with(|| {
+				charts.push(chart.clone());
+				charts.len() as u32 - 1
+			});
+			self.chart_indices.push(chart_index);
+		}
+
+		for (bucket, other_bucket) in [
+			(
+				&mut self.grades.aaaa_and_above,
+				&other.grades.aaaa_and_above,
+			),
+			(&mut self.grades.aaa, &other.grades.aaa),
+			(&mut self.grades.aa, &other.grades.aa),
+			(&mut self.grades.a, &other.grades.a),
+			(&mut self.grades.b_and_below, &other.grades.b_and_below),
+		]
+		.iter_mut()
+		{
+			bucket.extend(other_bucket.iter().map(|&i| i + offset));
+		}
+	}
+
+	pub fn len(&self) -> usize {
+		self.timestamps.len()
+	}
+
+	pub fn is_empty(&self) -> bool {
+		self.timestamps.is_empty()
+	}
+
+	pub fn datetime(&self, i: usize) -> crate::DateTime {
+		datetime_from_timestamp(self.timestamps[i])
+	}
+
+	pub fn date(&self, i: usize) -> chrono::NaiveDate {
+		self.datetime(i).0.date()
+	}
+
+	pub fn has_ssr(&self, i: usize) -> bool {
+		!self.ssrs[i][0].is_nan()
+	}
+
+	pub fn skillsets8(&self, i: usize) -> Option<etterna::Skillsets8> {
+		if !self.has_ssr(i) {
+			return None;
+		}
+		let ssr = &self.ssrs[i];
+		Some(etterna::Skillsets8 {
+			overall: ssr[0],
+			stream: ssr[1],
+			jumpstream: ssr[2],
+			handstream: ssr[3],
+			stamina: ssr[4],
+			jackspeed: ssr[5],
+			chordjack: ssr[6],
+			technical: ssr[7],
+		})
+	}
+
+	/// Overall SSR over time of the scores at the given indices
+	pub fn ssr_series(&self, indices: &[u32]) -> Vec<(crate::DateTime, f32)> {
+		indices
+			.iter()
+			.map(|&i| (self.datetime(i as usize), self.ssrs[i as usize][0]))
+			.collect()
+	}
+
+	pub fn acc_series(&self) -> Vec<(crate::DateTime, f32)> {
+		(0..self.len())
+			.map(|i| (self.datetime(i), self.wifescores[i]))
+			.collect()
+	}
+
+	/// Whether the given score is still the same as the score at index `i`, i.e. it hasn't been
+	/// rescored since
+	pub fn is_unchanged(&self, i: usize, score: &etterna_savegame::Score) -> bool {
+		// Comparing bits instead of floats, so that missing SSRs (NaN) compare equal
+		self.wifescores[i].to_bits() == score.wifescore_j4.as_proportion().to_bits()
+			&& (self.ssrs[i].iter())
+				.zip(&ssr_array(score))
+				.all(|(a, b)| a.to_bits() == b.to_bits())
+	}
+}
+
+/// Inverse of [`clamped_timestamp`]
+pub fn datetime_from_timestamp(timestamp: u32) -> crate::DateTime {
+	crate::DateTime(chrono::NaiveDateTime::from_timestamp(timestamp as i64, 0))
+}
+
+/// Seconds since the Unix epoch. Dates outside of the range that fits into a u32 (1970 to 2106)
+/// are clamped to it
+pub fn clamped_timestamp(datetime: chrono::NaiveDateTime) -> u32 {
+	datetime.timestamp().max(0).min(u32::MAX as i64) as u32
+}
+
+pub fn hash_key(key: &str) -> u64 {
+	let mut hasher = std::collections::hash_map::DefaultHasher::new();
+	key.hash(&mut hasher);
+	hasher.finish()
+}
+
+fn ssr_array(score: &etterna_savegame::Score) -> [f32; 8] {
+	match &score.ssr {
+		Some(ssr) => [
+			ssr.overall,
+			ssr.stream,
+			ssr.jumpstream,
+			ssr.handstream,
+			ssr.stamina,
+			ssr.jackspeed,
+			ssr.chordjack,
+			ssr.technical,
+		],
+		None => [f32::NAN; 8],
+	}
+}
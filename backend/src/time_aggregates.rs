@@ -0,0 +1,141 @@
+/*!
+Per-day, per-week and per-month summaries of a score series. Zoomed-out plots draw these instead of
+every single score
+*/
+
+use chrono::Datelike as _;
+use pyo3::prelude::*;
+
+/// Summary statistics of a series, one entry per time bucket. Buckets without scores are left out
+#[pyclass]
+#[derive(Debug, Clone, PartialEq, Default)]
+pub struct TimeAggregates {
+	/// Start of each bucket
+	#[pyo3(get)]
+	starts: Vec<crate::DateTime>,
+	#[pyo3(get)]
+	counts: Vec<u32>,
+	#[pyo3(get)]
+	means: Vec<f32>,
+	#[pyo3(get)]
+	mins: Vec<f32>,
+	#[pyo3(get)]
+	maxs: Vec<f32>,
+	#[pyo3(get)]
+	p25s: Vec<f32>,
+	#[pyo3(get)]
+	medians: Vec<f32>,
+	#[pyo3(get)]
+	p75s: Vec<f32>,
+}
+
+#[pyclass]
+#[derive(Debug, Clone, PartialEq, Default)]
+pub struct TimePyramid {
+	#[pyo3(get)]
+	day: TimeAggregates,
+	#[pyo3(get)]
+	week: TimeAggregates,
+	#[pyo3(get)]
+	month: TimeAggregates,
+}
+
+fn day_start(date: chrono::NaiveDate) -> chrono::NaiveDate {
+	date
+}
+
+fn week_start(date: chrono::NaiveDate) -> chrono::NaiveDate {
+	date - chrono::Duration::days(date.weekday().num_days_from_monday() as i64)
+}
+
+fn month_start(date: chrono::NaiveDate) -> chrono::NaiveDate {
+	chrono::NaiveDate::from_ymd(date.year(), date.month(), 1)
+}
+
+impl TimePyramid {
+	/// `points` must be sorted chronologically
+	pub fn calculate(points: &[(chrono::NaiveDate, f32)]) -> Self {
+		let mut pyramid = Self::default();
+		pyramid.day.push_buckets(points, day_start);
+		pyramid.week.push_buckets(points, week_start);
+		pyramid.month.push_buckets(points, month_start);
+		pyramid
+	}
+
+	/// Brings the aggregates up to date after points were appended. `points` are all points,
+	/// including the old ones, and the new ones must start at `first_new_date`. Only the buckets
+	/// from `first_new_date` on are recalculated
+	pub fn update(
+		&mut self,
+		points: &[(chrono::NaiveDate, f32)],
+		first_new_date: chrono::NaiveDate,
+	) {
+		self.day.recalculate_from(points, first_new_date, day_start);
+		self.week
+			.recalculate_from(points, first_new_date, week_start);
+		self.month
+			.recalculate_from(points, first_new_date, month_start);
+	}
+}
+
+impl TimeAggregates {
+	/// `points` must be sorted chronologically, so that each bucket is a contiguous range. They
+	/// must not be older than the last bucket
+	fn push_buckets(
+		&mut self,
+		points: &[(chrono::NaiveDate, f32)],
+		bucket_start: impl Fn(chrono::NaiveDate) -> chrono::NaiveDate,
+	) {
+		let mut values = Vec::new();
+		let mut i = 0;
+		while i < points.len() {
+			let start = bucket_start(points[i].0);
+			values.clear();
+			while i < points.len() && bucket_start(points[i].0) == start {
+				values.push(points[i].1);
+				i += 1;
+			}
+			self.push_bucket(start, &mut values);
+		}
+	}
+
+	/// Drops the bucket containing `date` and all later ones, and calculates them again from
+	/// `points`
+	fn recalculate_from(
+		&mut self,
+		points: &[(chrono::NaiveDate, f32)],
+		date: chrono::NaiveDate,
+		bucket_start: impl Fn(chrono::NaiveDate) -> chrono::NaiveDate,
+	) {
+		let start = bucket_start(date);
+
+		let num_kept_buckets = (self.starts).partition_point(|bucket| bucket.0.date() < start);
+		self.starts.truncate(num_kept_buckets);
+		self.counts.truncate(num_kept_buckets);
+		self.means.truncate(num_kept_buckets);
+		self.mins.truncate(num_kept_buckets);
+		self.maxs.truncate(num_kept_buckets);
+		self.p25s.truncate(num_kept_buckets);
+		self.medians.truncate(num_kept_buckets);
+		self.p75s.truncate(num_kept_buckets);
+
+		let first_point = points.partition_point(|&(point_date, _)| point_date < start);
+		self.push_buckets(&points[first_point..], bucket_start);
+	}
+
+	fn push_bucket(&mut self, start: chrono::NaiveDate, values: &mut [f32]) {
+		values.sort_by(|a, b| a.partial_cmp(b).unwrap_or(std::cmp::Ordering::Equal));
+		// Nearest-rank percentile
+		let percentile = |p: f32| values[((values.len() - 1) as f32 * p).round() as usize];
+
+		self.starts.push(crate::DateTime(start.and_hms(0, 0, 0)));
+		self.counts.push(values.len() as u32);
+		self.means
+			.push(values.iter().sum::<f32>() / values.len() as f32);
+		self.mins.push(values[0]);
+		self.maxs.push(values[values.len() - 1]);
+		self.p25s.push(percentile(0.25));
+		self.medians.push(percentile(0.5));
+		self.p75s.push(percentile(0.75));
+	}
+}
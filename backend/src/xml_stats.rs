@@ -1,3 +1,6 @@
+use std::collections::HashMap;
+use std::sync::Arc;
+
 use pyo3::prelude::*;
 
 use crate::pythrow;
@@ -7,12 +10,168 @@ use crate::pythrow;
 pub struct XmlStats {
 	#[pyo3(get)]
 	xml_path: String,
+	/// Shared between clones, since it's never modified after loading
+	scores: Arc<crate::ScoreTable>,
 	#[pyo3(get)]
-	ssr_over_time: SsrOverTime,
+	skillsets_over_time: Vec<(crate::DateTime, [f32; 8])>,
 	#[pyo3(get)]
-	acc_over_time: Vec<(crate::DateTime, f32)>,
+	acc_aggregates: crate::TimePyramid,
+	/// Aggregates of the overall SSR of all scores, regardless of grade. This is a deliberate
+	/// simplification: zoomed out, the five grade series collapse into this single band, because
+	/// five overlapping bands would be unreadable. The grades are only told apart when zoomed in
 	#[pyo3(get)]
-	skillsets_over_time: Vec<(crate::DateTime, [f32; 8])>,
+	ssr_aggregates: crate::TimePyramid,
+}
+
+#[pymethods]
+impl XmlStats {
+	#[getter]
+	fn ssr_over_time(&self) -> SsrOverTime {
+		SsrOverTime::from_table(&self.scores)
+	}
+
+	#[getter]
+	fn acc_over_time(&self) -> Vec<(crate::DateTime, f32)> {
+		self.scores.acc_series()
+	}
+
+	/// Rating at the given point in time, along with the scores that count towards it. Only scores
+	/// matching the filter arguments are considered
+	#[args(since = "None", excluded_packs = "Vec::new()", chart_keys = "None")]
+	fn rating_at(
+		&self,
+		py: Python,
+		datetime: crate::DateTime,
+		since: Option<crate::DateTime>,
+		excluded_packs: Vec<String>,
+		chart_keys: Option<Vec<String>>,
+	) -> crate::RatingSnapshot {
+		let filter = crate::RatingFilter {
+			since,
+			until: Some(datetime),
+			excluded_packs,
+			chart_keys,
+			min_wifescore: None,
+		};
+		py.allow_threads(|| crate::calculate_rating_snapshot(&self.scores, &filter))
+	}
+
+	/// Like `skillsets_over_time`, but only considering the scores that match the filter arguments
+	#[args(
+		since = "None",
+		until = "None",
+		excluded_packs = "Vec::new()",
+		chart_keys = "None"
+	)]
+	fn rating_over_time(
+		&self,
+		py: Python,
+		since: Option<crate::DateTime>,
+		until: Option<crate::DateTime>,
+		excluded_packs: Vec<String>,
+		chart_keys: Option<Vec<String>>,
+	) -> Vec<(crate::DateTime, [f32; 8])> {
+		let filter = crate::RatingFilter {
+			since,
+			until,
+			excluded_packs,
+			chart_keys,
+			min_wifescore: None,
+		};
+		py.allow_threads(|| crate::calculate_rating_over_time(&self.scores, &filter))
+	}
+
+	/// Rolling statistics of accuracy (`series="accuracy"`) or overall SSR (`series="ssr"`) over
+	/// either the last `window_scores` scores or the last `window_days` days. `percentiles` are in
+	/// the range 0 to 1
+	#[args(
+		window_scores = "None",
+		window_days = "None",
+		percentiles = "Vec::new()"
+	)]
+	fn rolling_stats(
+		&self,
+		py: Python,
+		series: &str,
+		window_scores: Option<usize>,
+		window_days: Option<u32>,
+		percentiles: Vec<f32>,
+	) -> PyResult<crate::RollingStats> {
+		let window = match (window_scores, window_days) {
+			(Some(num_scores), None) if num_scores >= 1 => crate::RollingWindow::Scores(num_scores),
+			(None, Some(num_days)) if num_days >= 1 => crate::RollingWindow::Days(num_days),
+			_ => {
+				return Err(pythrow(
+					"Exactly one of window_scores and window_days must be given, and be at least 1",
+				))
+			}
+		};
+
+		if !percentiles.iter().all(|p| (0.0..=1.0).contains(p)) {
+			return Err(pythrow("percentiles must be between 0 and 1"));
+		}
+
+		let scores = &self.scores;
+		let points = match series {
+			"accuracy" => (0..scores.len())
+				.map(|i| (scores.timestamps[i], scores.wifescores[i]))
+				.collect::<Vec<_>>(),
+			"ssr" => (0..scores.len())
+				.filter(|&i| scores.has_ssr(i))
+				.map(|i| (scores.timestamps[i], scores.ssrs[i][0]))
+				.collect::<Vec<_>>(),
+			_ => return Err(pythrow(format!("Unknown series: {}", series))),
+		};
+
+		Ok(py.allow_threads(|| crate::calculate_rolling_stats(&points, window, &percentiles)))
+	}
+}
+
+impl XmlStats {
+	/// Calculates everything that's derived from the score table
+	fn from_scores(xml_path: &str, scores: crate::ScoreTable) -> Self {
+		Self {
+			xml_path: xml_path.to_owned(),
+			skillsets_over_time: crate::calculate_rating_over_time(
+				&scores,
+				&crate::RatingFilter::default(),
+			),
+			acc_aggregates: crate::TimePyramid::calculate(&acc_points(&scores)),
+			ssr_aggregates: crate::TimePyramid::calculate(&ssr_points(&scores)),
+			scores: Arc::new(scores),
+		}
+	}
+
+	/// Adds scores that aren't older than any of the existing scores. Only the rating timeline days
+	/// and the aggregates that the new scores fall into are recalculated
+	fn with_appended_scores(&self, new_scores: &crate::ScoreTable) -> Self {
+		let first_new_score = self.scores.len();
+		let mut scores = (*self.scores).clone();
+		scores.append(new_scores);
+
+		let mut stats = Self {
+			xml_path: self.xml_path.clone(),
+			skillsets_over_time: self.skillsets_over_time.clone(),
+			acc_aggregates: self.acc_aggregates.clone(),
+			ssr_aggregates: self.ssr_aggregates.clone(),
+			scores: Arc::new(scores),
+		};
+		if !new_scores.is_empty() {
+			let first_new_date = new_scores.date(0);
+			crate::update_rating_over_time(
+				&stats.scores,
+				&mut stats.skillsets_over_time,
+				first_new_score,
+			);
+			(stats.acc_aggregates).update(&acc_points(&stats.scores), first_new_date);
+			(stats.ssr_aggregates).update(&ssr_points(&stats.scores), first_new_date);
+		}
+		stats
+	}
+
+	pub fn scores(&self) -> &crate::ScoreTable {
+		&self.scores
+	}
 }
 
 #[pyclass]
@@ -30,83 +189,156 @@ pub struct SsrOverTime {
 	b_and_below: Vec<(crate::DateTime, f32)>,
 }
 
-pub fn load_xml_stats(xml_path: &str, progress: crate::ProgressHandler) -> PyResult<XmlStats> {
-	let mut progress = progress.init(4)?;
-
-	progress.step("Opening Etterna.xml...")?;
-	let xml = etterna_savegame::XmlData::from_etterna_xml(xml_path.as_ref()).map_err(pythrow)?;
-	let scores = xml.scores_chronologically();
-
-	progress.step("Calculating SSRs over time...")?;
-	let mut ssr_over_time = SsrOverTime::default();
-	for chart in &xml.player_scores.charts {
-		for scores_at in &chart.scores_at {
-			for score in &scores_at.scores {
-				if let Some(ssr) = &score.ssr {
-					let entry = (crate::DateTime(score.datetime), ssr.overall);
-					if score.wifescore_j4 >= etterna::Wifescore::AAAA_THRESHOLD {
-						ssr_over_time.aaaa_and_above.push(entry);
-					} else if score.wifescore_j4 >= etterna::Wifescore::AAA_THRESHOLD {
-						ssr_over_time.aaa.push(entry);
-					} else if score.wifescore_j4 >= etterna::Wifescore::AA_THRESHOLD {
-						ssr_over_time.aa.push(entry);
-					} else if score.wifescore_j4 >= etterna::Wifescore::A_THRESHOLD {
-						ssr_over_time.a.push(entry);
-					} else {
-						ssr_over_time.b_and_below.push(entry);
-					}
-				}
-			}
+impl SsrOverTime {
+	fn from_table(scores: &crate::ScoreTable) -> Self {
+		Self {
+			aaaa_and_above: scores.ssr_series(&scores.grades.aaaa_and_above),
+			aaa: scores.ssr_series(&scores.grades.aaa),
+			aa: scores.ssr_series(&scores.grades.aa),
+			a: scores.ssr_series(&scores.grades.a),
+			b_and_below: scores.ssr_series(&scores.grades.b_and_below),
 		}
 	}
+}
 
-	progress.step("Calculating accuracy over time...")?;
-	let acc_over_time = scores
-		.iter()
-		.map(|score| {
-			(
-				crate::DateTime(score.datetime),
-				score.wifescore_j4.as_proportion(),
-			)
-		})
-		.collect();
+fn acc_points(scores: &crate::ScoreTable) -> Vec<(chrono::NaiveDate, f32)> {
+	(0..scores.len())
+		.map(|i| (scores.date(i), scores.wifescores[i]))
+		.collect()
+}
 
-	progress.step("Calculating skillsets over time...")?;
-	let skill_timeline = etterna::SkillTimeline::calculate(
-		scores.iter().filter_map(|score| {
-			let ssr = score.ssr.as_ref()?;
-			Some((
-				crate::DateTime(score.datetime.date().and_hms(0, 0, 0)),
-				ssr.to_skillsets7(),
-			))
-		}),
-		false,
-	);
-	let skillsets_over_time = skill_timeline
-		.changes
+fn ssr_points(scores: &crate::ScoreTable) -> Vec<(chrono::NaiveDate, f32)> {
+	(0..scores.len())
+		.filter(|&i| scores.has_ssr(i))
+		.map(|i| (scores.date(i), scores.ssrs[i][0]))
+		.collect()
+}
+
+pub fn load_xml_stats(xml_path: &str, progress: crate::ProgressHandler) -> PyResult<XmlStats> {
+	let mut progress = progress.init(3)?;
+	calculate_xml_stats(xml_path, |progress_text| progress.step(progress_text))
+}
+
+/// Loads the Etterna.xml of multiple profiles concurrently, each one in its own thread. The
+/// progress bar advances whenever one of the profiles has finished loading. Returns the stats in
+/// the same order as `xml_paths`
+pub fn load_xml_stats_multiple(
+	xml_paths: &[String],
+	progress: crate::ProgressHandler,
+) -> PyResult<Vec<XmlStats>> {
+	let mut progress = progress.init(xml_paths.len() as u32)?;
+
+	let paths = xml_paths.to_vec();
+	let receiver = crate::spawn_workers(xml_paths.len(), xml_paths.len(), move |i, sender| {
+		// If the receiver is gone, loading was aborted and nobody cares about the result
+		let _ = sender.send((i, calculate_xml_stats(&paths[i], |_| Ok(()))));
+	});
+
+	let mut all_stats = xml_paths.iter().map(|_| None).collect::<Vec<_>>();
+	for (num_loaded, (i, stats)) in receiver.into_iter().enumerate() {
+		progress.step(&format!(
+			"Loaded {} out of {} profiles...",
+			num_loaded + 1,
+			xml_paths.len()
+		))?;
+		all_stats[i] = Some(stats?);
+	}
+
+	all_stats
 		.into_iter()
-		.map(|(datetime, rating)| {
-			(
-				datetime,
-				[
-					rating.overall,
-					rating.stream,
-					rating.jumpstream,
-					rating.handstream,
-					rating.stamina,
-					rating.jackspeed,
-					rating.chordjack,
-					rating.technical,
-				],
-			)
+		.zip(xml_paths)
+		.map(|(stats, xml_path)| {
+			stats.ok_or_else(|| pythrow(format!("Thread for loading {} crashed", xml_path)))
 		})
-		.collect();
+		.collect()
+}
+
+/// Parses the given Etterna.xml and calculates all stats from it. `step` is called at the
+/// beginning of each of the three processing steps
+fn calculate_xml_stats(
+	xml_path: &str,
+	mut step: impl FnMut(&str) -> PyResult<()>,
+) -> PyResult<XmlStats> {
+	step("Opening Etterna.xml...")?;
+	let scores = {
+		// The parsed XML is only needed until the scores are in the table
+		let xml =
+			etterna_savegame::XmlData::from_etterna_xml(xml_path.as_ref()).map_err(pythrow)?;
+		step("Collecting scores...")?;
+		crate::ScoreTable::from_scores(&xml.scores_with_charts_chronologically())
+	};
+
+	step("Calculating skillsets and aggregates over time...")?;
+	Ok(XmlStats::from_scores(xml_path, scores))
+}
+
+#[pyclass]
+pub struct XmlStatsUpdate {
+	/// The complete stats after the update
+	#[pyo3(get)]
+	stats: XmlStats,
+	/// False if previously loaded scores were changed or removed. In that case, the new stats
+	/// can't be obtained by appending `new_ssr_over_time` and `new_acc_over_time` to the old ones
+	#[pyo3(get)]
+	append_only: bool,
+	/// SSRs of the scores that weren't in the old stats
+	#[pyo3(get)]
+	new_ssr_over_time: SsrOverTime,
+	/// Accuracies of the scores that weren't in the old stats
+	#[pyo3(get)]
+	new_acc_over_time: Vec<(crate::DateTime, f32)>,
+}
+
+/// Reads the Etterna.xml of the given stats again and diffs in the scores that were added or
+/// changed since
+pub fn update_xml_stats(
+	stats: &XmlStats,
+	progress: crate::ProgressHandler,
+) -> PyResult<XmlStatsUpdate> {
+	let mut progress = progress.init(3)?;
+
+	progress.step("Opening Etterna.xml...")?;
+	let xml =
+		etterna_savegame::XmlData::from_etterna_xml(stats.xml_path.as_ref()).map_err(pythrow)?;
+	let scores = xml.scores_with_charts_chronologically();
 
-	Ok(XmlStats {
-		xml_path: xml_path.to_owned(),
-		ssr_over_time,
-		acc_over_time,
-		skillsets_over_time,
+	progress.step("Looking for new scores...")?;
+	let old_score_indices = (stats.scores.key_hashes.iter())
+		.enumerate()
+		.map(|(i, &key_hash)| (key_hash, i))
+		.collect::<HashMap<_, _>>();
+	let mut num_unchanged_scores = 0;
+	let mut new_scores = Vec::new();
+	for &(chart, score) in &scores {
+		match old_score_indices.get(&crate::hash_key(&score.key)) {
+			Some(&i) if stats.scores.is_unchanged(i, score) => num_unchanged_scores += 1,
+			Some(_) => {} // changed score
+			None => new_scores.push((chart, score)),
+		}
+	}
+	let append_only = num_unchanged_scores == stats.scores.len();
+
+	let new_part = crate::ScoreTable::from_scores(&new_scores);
+	// Scores can only be appended to the table if they're not older than the existing ones
+	let is_chronological = match (stats.scores.timestamps.last(), new_part.timestamps.first()) {
+		(Some(last_old), Some(first_new)) => first_new >= last_old,
+		_ => true,
+	};
+	let new_stats = if append_only && new_scores.is_empty() {
+		stats.clone()
+	} else if append_only && is_chronological {
+		progress.step("Calculating skillsets and aggregates over time...")?;
+		stats.with_appended_scores(&new_part)
+	} else {
+		progress.step("Calculating skillsets and aggregates over time...")?;
+		XmlStats::from_scores(&stats.xml_path, crate::ScoreTable::from_scores(&scores))
+	};
+
+	Ok(XmlStatsUpdate {
+		stats: new_stats,
+		append_only,
+		new_ssr_over_time: SsrOverTime::from_table(&new_part),
+		new_acc_over_time: new_part.acc_series(),
 	})
 }
 
@@ -125,26 +357,16 @@ pub fn calculate_acc_rating_over_time(
 	stats: &XmlStats,
 	progress: crate::ProgressHandler,
 ) -> PyResult<AccRatingOverTime> {
-	let xml =
-		etterna_savegame::XmlData::from_etterna_xml(stats.xml_path.as_ref()).map_err(pythrow)?;
-	let scores = xml.scores_chronologically();
-
-	let iter_scores_with_threshold = |threshold| -> Vec<(crate::DateTime, f32)> {
-		let skill_timeline = etterna::SkillTimeline::calculate(
-			scores.iter().filter_map(|score| {
-				if score.wifescore_j4 < threshold {
-					return None;
-				}
-				let ssr = score.ssr.as_ref()?;
-
-				Some((score.datetime.date(), ssr.to_skillsets7()))
-			}),
-			false,
-		);
-		skill_timeline
-			.changes
-			.into_iter()
-			.map(|(date, rating)| (crate::DateTime(date.and_hms(0, 0, 0)), rating.overall))
+	let scores = &stats.scores;
+
+	// Same rating calculation as for skillsets_over_time, so that the lines are comparable
+	let iter_scores_with_threshold = |threshold: f32| -> Vec<(crate::DateTime, f32)> {
+		let filter = crate::RatingFilter {
+			min_wifescore: Some(threshold),
+			..Default::default()
+		};
+		(crate::calculate_rating_over_time(scores, &filter).into_iter())
+			.map(|(datetime, [overall, ..])| (datetime, overall))
 			.collect()
 	};
 
@@ -156,9 +378,9 @@ pub fn calculate_acc_rating_over_time(
 
 	let mut progress = progress.init(2)?;
 	progress.step("Calculating AAA-only rating...")?;
-	let aaa = iter_scores_with_threshold(etterna::Wifescore::AAA_THRESHOLD);
+	let aaa = iter_scores_with_threshold(etterna::Wifescore::AAA_THRESHOLD.as_proportion());
 	progress.step("Calculating AAAA-only rating...")?;
-	let aaaa = iter_scores_with_threshold(etterna::Wifescore::AAAA_THRESHOLD);
+	let aaaa = iter_scores_with_threshold(etterna::Wifescore::AAAA_THRESHOLD.as_proportion());
 
 	Ok(AccRatingOverTime { normal, aaa, aaaa })
 }
@@ -0,0 +1,103 @@
+from __future__ import annotations
+from typing import *
+
+from datetime import datetime
+
+from PyQt5.QtWidgets import QWidget, QGridLayout, QVBoxLayout, QComboBox
+
+import backend, globals
+from plot_wrapper import PlotWrapper, ScatterPlotItem, PlotItem, LinePlotItem, LinkGroup
+
+
+def all_ssrs(stats: backend.XmlStats) -> List[Tuple[datetime, float]]:
+	ssr_over_time = stats.ssr_over_time
+	return sorted(
+		ssr_over_time.aaaa_and_above + ssr_over_time.aaa + ssr_over_time.aa
+		+ ssr_over_time.a + ssr_over_time.b_and_below
+	)
+
+class ComparisonTab(QWidget):
+	"""
+	Shows the stats of multiple profiles in the same plots. The plots can either be aligned by
+	calendar date, or by the time that passed since each player's first score
+	"""
+
+	def __init__(self, profiles: List[Tuple[str, backend.XmlStats]]):
+		super().__init__()
+		self._profiles = profiles
+
+		self._layout = QVBoxLayout()
+		self.setLayout(self._layout)
+
+		alignment_options = QComboBox()
+		alignment_options.addItem("Align by date")
+		alignment_options.addItem("Align by time since first score")
+		alignment_options.currentIndexChanged.connect(self._current_index_changed)
+		self._layout.addWidget(alignment_options)
+
+		self._plots = QWidget() # This dummy will be replaced by setup function later
+		self._layout.addWidget(self._plots)
+
+		self._current_index_changed(0) # Trigger first render
+
+	def _current_index_changed(self, index: int):
+		if index == 0:
+			new_plots = self._setup_plots(align_by_first_score=False)
+		elif index == 1:
+			new_plots = self._setup_plots(align_by_first_score=True)
+		else:
+			print(f"Warning: unknown dropdown index {index}. Ignoring")
+			return
+
+		self._layout.replaceWidget(self._plots, new_plots)
+		self._plots.deleteLater()
+		self._plots = new_plots
+		self._layout.invalidate() # Causes glitches otherwise
+
+	def _setup_plots(self, align_by_first_score: bool) -> QWidget:
+		rating_items, acc_items, ssr_items = [], [], []
+		for i, (name, stats) in enumerate(self._profiles):
+			color = globals.PROFILE_COLORS[i % len(globals.PROFILE_COLORS)]
+
+			rating_points = [(dt, rating[0]) for dt, rating in stats.skillsets_over_time]
+			acc_dots = stats.acc_over_time
+			ssr_dots = all_ssrs(stats)
+
+			if align_by_first_score and len(acc_dots) >= 1:
+				# acc_over_time contains every score, so its first entry is the first score
+				first_score_dt = acc_dots[0][0]
+				def days_since_first_score(points: List[Tuple[datetime, float]]) -> List[Tuple[float, float]]:
+					return [((dt - first_score_dt).total_seconds() / globals.SECONDS_PER_DAY, y) for dt, y in points]
+				rating_points = days_since_first_score(rating_points)
+				acc_dots = days_since_first_score(acc_dots)
+				ssr_dots = days_since_first_score(ssr_dots)
+
+			if len(rating_points) >= 1:
+				rating_items.append(PlotItem(
+					data=LinePlotItem(points=rating_points, width=3),
+					color=color, legend_name=name,
+				))
+			if len(acc_dots) >= 1:
+				acc_items.append(PlotItem(data=ScatterPlotItem(dots=acc_dots), color=color, legend_name=name))
+			if len(ssr_dots) >= 1:
+				ssr_items.append(PlotItem(data=ScatterPlotItem(dots=ssr_dots), color=color, legend_name=name))
+
+		plots = QWidget()
+		layout = QGridLayout()
+		plots.setLayout(layout)
+
+		link_group = LinkGroup()
+		x_axis_name = " (days since first score)" if align_by_first_score else ""
+		def make_plot(items: List[PlotItem], title: str) -> PlotWrapper:
+			return PlotWrapper(
+				item=items,
+				title=title + x_axis_name,
+				datetime_x_axis=not align_by_first_score,
+				show_x_crosshair=True,
+				link_group=link_group,
+			)
+		layout.addWidget(make_plot(rating_items, "Overall rating over time"), 0, 0)
+		layout.addWidget(make_plot(ssr_items, "Score rating over time"), 0, 1)
+		layout.addWidget(make_plot(acc_items, "Accuracy over time"), 1, 0, 1, 2)
+
+		return plots
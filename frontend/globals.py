@@ -1,3 +1,5 @@
+SECONDS_PER_DAY = 60 * 60 * 24
+
 BG_COLOR = "#222222"
 TEXT_COLOR = "#DDDDDD"
 BORDER_COLOR = "#777777"
@@ -14,4 +16,7 @@ A_COLOR = "da5757"
 AA_COLOR = "66cc66"
 AAA_COLOR = "eebb00"
 AAAA_COLOR = "66ccff"
-AAAAA_COLOR = "ffffff"
\ No newline at end of file
+AAAAA_COLOR = "ffffff"
+
+# Colors to tell apart multiple profiles in the same plot
+PROFILE_COLORS = ["1f77b4", "ff7f0e", "2ca02c", "d62728", "9467bd", "8c564b", "e377c2", "17becf"]
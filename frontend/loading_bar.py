@@ -8,6 +8,18 @@ from PyQt5.QtCore import pyqtSignal, pyqtSlot, QRunnable, QObject, QThreadPool,
 T = TypeVar("T") # User data
 R = TypeVar("R") # Return value
 
+def returning_exceptions(task: Callable[..., R]) -> Callable[..., Union[R, Exception]]:
+	"""
+	Wraps a background task to return the exceptions it raises. Raised exceptions wouldn't reach the
+	finished callback, which would then never be called
+	"""
+	def wrapper(*args):
+		try:
+			return task(*args)
+		except Exception as e:
+			return e
+	return wrapper
+
 def run_in_background(
 	task: Callable[[pyqtSignal[int], pyqtSignal[int], pyqtSignal[T]], R],
 	progress_bar: Union[QProgressBar, QProgressDialog],
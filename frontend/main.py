@@ -3,18 +3,22 @@ from typing import *
 
 import time, logging
 from dataclasses import dataclass
+from pathlib import Path
 
 import pyqtgraph as pg
 from PyQt5.Qt import QIcon
 from PyQt5.QtWidgets import QPushButton, QApplication, QMainWindow, QTabWidget, QLabel, QMessageBox
 from PyQt5.QtWidgets import QWidget, QGridLayout, QVBoxLayout, QRadioButton, QFrame, QDialog
-from PyQt5.QtWidgets import QDialogButtonBox, QLineEdit, QStyle
+from PyQt5.QtWidgets import QDialogButtonBox, QLineEdit, QStyle, QCheckBox
 
 import backend, texts, globals
 from path_input import request_etterna_profile_paths
-from loading_bar import blocking_loading_bar
+from loading_bar import blocking_loading_bar, returning_exceptions
 from tab_widget_unlockable import TabWidgetUnlockable
 from xml_stats_tab import XmlStatsTab
+from comparison_tab import ComparisonTab
+from replays_stats_tab import ReplaysStatsTab
+from xml_watcher import XmlWatcher
 
 
 def confirm_operation(title: str, message: str) -> bool:
@@ -30,18 +34,21 @@ def horizontal_separator() -> QWidget:
 	return line
 
 class MainTabWidget(TabWidgetUnlockable):
+	xml_stats_tab: XmlStatsTab
 	_replays_analysis: Optional[backend.ReplaysAnalysis]
 	_charts_analysis: Optional[backend.ChartsAnalysis]
 
-	def __init__(self, xml_stats: backend.XmlStats):
+	def __init__(self, xml_stats: backend.XmlStats, replays_dir: str):
 		super().__init__()
 
+		self._replays_dir = replays_dir
 		self._replays_analysis = None
 		self._charts_analysis = None
 
 		self.setTabShape(QTabWidget.Triangular)
 		
-		self.addTab(XmlStatsTab(xml_stats), "XML data")
+		self.xml_stats_tab = XmlStatsTab(xml_stats)
+		self.addTab(self.xml_stats_tab, "XML data")
 		self.addUnlockableTab(self._unlock_replay_stats, "Replay data")
 		self.addUnlockableTab(self._unlock_chart_stats, "Chart data")
 	
@@ -50,8 +57,11 @@ class MainTabWidget(TabWidgetUnlockable):
 			"In order to display these stats, the program needs to read and analyse "
 			+ "your entire replay data. This may take a while"
 		):
-			self._replays_analysis = blocking_loading_bar(backend.load_replays_analysis, "Analysing replays...")
-			return ReplaysStatsTab(self._replays_analysis)
+			def finished(replays_analysis: backend.ReplaysAnalysis) -> None:
+				self._replays_analysis = replays_analysis
+
+			# The stats after the latest live reload, so that replays of new scores can be dated
+			return ReplaysStatsTab(self._replays_dir, self.xml_stats_tab.stats, finished)
 		else:
 			return None
 
@@ -60,7 +70,7 @@ class MainTabWidget(TabWidgetUnlockable):
 			QMessageBox.information(
 				None,
 				"Replays required",
-				"First, replays need to be analyzed (press the replays data tab)"
+				"First, replays need to be analyzed (press the replays data tab and wait until it's done)"
 			)
 			return False
 
@@ -74,10 +84,6 @@ class MainTabWidget(TabWidgetUnlockable):
 		else:
 			return None
 
-class ReplaysStatsTab(QLabel):
-	def __init__(self, replays_analysis: backend.ReplaysAnalysis):
-		super().__init__("Replay stuff: " + repr(replays_analysis))
-
 class ChartsStatsTab(QLabel):
 	def __init__(self, charts_analysis: backend.ChartsAnalysis):
 		super().__init__("Charts stuff: " + repr(charts_analysis))
@@ -128,6 +134,73 @@ def choose_profile(options: List[backend.EtternaInstallation]) -> Optional[backe
 	dialog.exec()
 	return return_value
 
+def profile_display_name(profile: backend.DetectedEtternaProfile) -> str:
+	# The base directory alone is ambiguous when an installation has multiple local profiles
+	return f"{Path(profile.base).name}/{Path(profile.paths.xml).parent.name}"
+
+# Returns an empty list if the user quitted the dialog
+def choose_comparison_profiles(
+	options: List[backend.DetectedEtternaProfile],
+) -> List[backend.DetectedEtternaProfile]:
+	dialog = QDialog()
+	layout = QVBoxLayout()
+	dialog.setLayout(layout)
+
+	layout.addWidget(QLabel("Select the profiles to compare:"))
+
+	checkboxes = [
+		QCheckBox(f"{profile_display_name(option)}\n{option.xml_size_mb:.1f}MB XML, {option.num_replays} replays")
+		for option in options
+	]
+
+	button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+	button_box.accepted.connect(lambda: dialog.accept())
+	button_box.rejected.connect(lambda: dialog.reject())
+
+	# A comparison needs at least two profiles
+	def update_ok_button() -> None:
+		num_checked = sum(checkbox.isChecked() for checkbox in checkboxes)
+		button_box.button(QDialogButtonBox.Ok).setEnabled(num_checked >= 2)
+
+	for checkbox in checkboxes:
+		checkbox.setChecked(True)
+		checkbox.toggled.connect(lambda checked: update_ok_button())
+		layout.addWidget(checkbox)
+	layout.addWidget(button_box)
+	update_ok_button()
+
+	if dialog.exec() != QDialog.Accepted:
+		return []
+	return [option for option, checkbox in zip(options, checkboxes) if checkbox.isChecked()]
+
+def open_comparison_tab(tab_widget: QTabWidget) -> None:
+	options = backend.detect_etterna_profiles()
+	if len(options) < 2:
+		QMessageBox.information(None, "Not enough profiles",
+			"At least two Etterna profiles need to be detected in order to compare them")
+		return
+
+	profiles = choose_comparison_profiles(options)
+	if len(profiles) == 0:
+		return
+
+	@returning_exceptions
+	def task(*args) -> List[backend.XmlStats]:
+		return backend.load_xml_stats_multiple([p.paths.xml for p in profiles], *args)
+
+	# All profiles are loaded concurrently, so this takes about as long as the largest profile
+	all_stats = blocking_loading_bar(task, "Loading XML data...")
+	if isinstance(all_stats, Exception):
+		logging.warning(f"Couldn't load profiles for comparison: {all_stats}")
+		QMessageBox.critical(None, "Couldn't load profiles",
+			f"One of the selected profiles couldn't be loaded: {all_stats}")
+		return
+
+	comparison_tab = ComparisonTab([
+		(profile_display_name(profile), stats) for profile, stats in zip(profiles, all_stats)
+	])
+	tab_widget.setCurrentIndex(tab_widget.addTab(comparison_tab, "Comparison"))
+
 if __name__ == "__main__":
 	logging.getLogger().setLevel(logging.DEBUG)
 
@@ -153,8 +226,15 @@ if __name__ == "__main__":
 
 	window = QMainWindow()
 	window.resize(1280, 720)
-	window.setCentralWidget(MainTabWidget(xml_stats))
+	main_tab_widget = MainTabWidget(xml_stats, config.paths.replays_dir)
+	window.setCentralWidget(main_tab_widget)
 	file_menu = window.menuBar().addMenu("File")
+	file_menu.addAction("Compare profiles...", lambda: open_comparison_tab(main_tab_widget))
+	xml_watcher = XmlWatcher(xml_stats, main_tab_widget.xml_stats_tab, window.statusBar())
+	live_reload_action = file_menu.addAction("Live reload Etterna.xml")
+	live_reload_action.setCheckable(True)
+	live_reload_action.setChecked(True)
+	live_reload_action.toggled.connect(xml_watcher.set_enabled)
 	file_menu.addAction("About", lambda: QMessageBox.about(None, "About", texts.ABOUT))
 	file_menu.addAction("About Qt", lambda: QApplication.aboutQt())
 	window.show()
@@ -8,12 +8,23 @@ from dataclasses import dataclass
 import pyqtgraph as pg
 from PyQt5.QtCore import QPointF
 
-import globals
+import backend, globals
 
 
 PRIMARY_CROSSHAIR_PEN = pg.mkPen(0.5)
 SECONDARY_CROSSHAIR_PEN = pg.mkPen(0.3)
 
+# Names of the TimePyramid levels and the approximate length of their buckets, from finest to coarsest
+AGGREGATE_RESOLUTIONS = [
+	("day", globals.SECONDS_PER_DAY),
+	("week", 7 * globals.SECONDS_PER_DAY),
+	("month", 30.44 * globals.SECONDS_PER_DAY),
+]
+# Individual scores are drawn as long as each day gets at least this much horizontal space
+RAW_MIN_PIXELS_PER_DAY = 8
+# A resolution is chosen if each of its buckets gets at least this much horizontal space
+AGGREGATE_MIN_PIXELS_PER_BUCKET = 4
+
 A = TypeVar("A")
 B = TypeVar("B")
 def _transpose_tuples(tuples: Iterable[Tuple[A, B]]) -> Tuple[List[A], List[B]]:
@@ -24,14 +35,36 @@ def _transpose_tuples(tuples: Iterable[Tuple[A, B]]) -> Tuple[List[A], List[B]]:
 
 X = TypeVar("X", datetime, float) # possible types for x coordinates
 
+@dataclass
+class Coordinates:
+	"""
+	Points split into the coordinate lists that pyqtgraph takes, with datetimes as timestamps.
+	Converting is slow for long series, so this allows doing it in a background thread beforehand
+	"""
+	x: List[float]
+	y: List[float]
+
+def to_coordinates(points: List[Tuple[X, float]], datetime_x_axis: bool) -> Coordinates:
+	if len(points) == 0:
+		return Coordinates([], [])
+
+	# Extract list of coordinate tuples into tuple of coordinate lists
+	x, y = _transpose_tuples(points)
+
+	# PyQtGraph's datetime axis expects timestamps
+	if datetime_x_axis:
+		x = [x_val.timestamp() for x_val in x] # type: ignore
+
+	return Coordinates(x, y) # type: ignore
+
 @dataclass
 class ScatterPlotItem(Generic[X]):
-	dots: List[Tuple[X, float]]
+	dots: Union[List[Tuple[X, float]], Coordinates]
 
 # Doesn't interpolate by default
 @dataclass
 class LinePlotItem(Generic[X]):
-	points: List[Tuple[X, float]]
+	points: Union[List[Tuple[X, float]], Coordinates]
 	width: int = 1
 
 @dataclass
@@ -48,7 +81,13 @@ class PlotWrapper(pg.PlotWidget, Generic[X]):
 		show_x_crosshair: bool = False,
 		crosshair_move_callback: Callable[[X], None] = lambda x: None,
 		link_group: LinkGroup = None,
+		aggregates: Optional[backend.TimePyramid] = None,
+		aggregates_color: str = "ffffff",
 	):
+		"""
+		If `aggregates` is given, the plot shows them instead of the individual scatter items when
+		zoomed out far enough. This requires a datetime x axis
+		"""
 		self._datetime_x_axis = datetime_x_axis
 		
 		# These are global config options, but there's no neat place to put them so we just
@@ -67,7 +106,15 @@ class PlotWrapper(pg.PlotWidget, Generic[X]):
 		
 		self._setup_items_and_legend([item] if isinstance(item, PlotItem) else list(item))
 		self._setup_crosshair(show_x_crosshair, crosshair_move_callback, link_group)
+		self._setup_aggregates(aggregates, aggregates_color)
 	
+	def _to_coordinate_lists(self,
+		points: Union[List[Tuple[X, float]], Coordinates],
+	) -> Tuple[List[float], List[float]]:
+		if not isinstance(points, Coordinates):
+			points = to_coordinates(points, self._datetime_x_axis)
+		return (points.x, points.y)
+
 	def _setup_items_and_legend(self, item_specs: List[PlotItem[X]]):
 		legend = pg.LegendItem()
 		items_to_add_to_plot = []
@@ -75,24 +122,14 @@ class PlotWrapper(pg.PlotWidget, Generic[X]):
 			color = pg.mkColor(item_spec.color)
 			
 			if isinstance(item_spec.data, ScatterPlotItem):
-				# Extract list of coordinate tuples into tuple of coordinate lists
-				x, y = _transpose_tuples(item_spec.data.dots)
+				x, y = self._to_coordinate_lists(item_spec.data.dots)
 
 				# semi-transparent scatter dots are nice :)
 				color.setAlphaF(0.8)
-
-				# PyQtGraph's datetime axis expects timestamps
-				if self._datetime_x_axis:
-					x = [x_val.timestamp() for x_val in x] # type: ignore
 				
 				item = pg.ScatterPlotItem(x, y, pen=None, size=8, brush=color)
 			elif isinstance(item_spec.data, LinePlotItem):
-				# Extract list of coordinate tuples into tuple of coordinate lists
-				x, y = _transpose_tuples(item_spec.data.points)
-
-				# PyQtGraph's datetime axis expects timestamps
-				if self._datetime_x_axis:
-					x = [x_val.timestamp() for x_val in x] # type: ignore
+				x, y = self._to_coordinate_lists(item_spec.data.points)
 				
 				pen = pg.mkPen(color, width=item_spec.data.width)
 				item = pg.PlotCurveItem(x, y, pen=pen, stepMode="left")
@@ -104,6 +141,7 @@ class PlotWrapper(pg.PlotWidget, Generic[X]):
 		# Draw in reverse so the first supplied item is on top
 		for item in reversed(items_to_add_to_plot):
 			self.getPlotItem().addItem(item)
+		self._items = items_to_add_to_plot
 		
 		# Show legend only if there were items with an associated legend name
 		if len(legend.items) >= 1:
@@ -113,6 +151,113 @@ class PlotWrapper(pg.PlotWidget, Generic[X]):
 			# Anchor the item's edge at the parent's edge with a certain offset
 			legend.anchor(itemPos=(0, 0), parentPos=(0, 0), offset=(45, 45))
 
+	def append_data(self, item_index: int, points: Union[List[Tuple[X, float]], Coordinates]) -> None:
+		"""
+		Adds points to the scatter plot item at the given index, without rebuilding the item. The
+		index refers to the order in which the items were passed to the constructor
+		"""
+		item = self._items[item_index]
+		if not isinstance(item, pg.ScatterPlotItem):
+			raise TypeError("Only scatter plot items support appending data")
+		x, y = self._to_coordinate_lists(points)
+		if len(x) == 0:
+			return
+
+		# New points without style arguments are drawn with the item's default style
+		item.addPoints(x=x, y=y)
+
+	def set_data(self, item_index: int, points: Union[List[Tuple[X, float]], Coordinates]) -> None:
+		"""
+		Replaces the points of the item at the given index, without rebuilding the item. The index
+		refers to the order in which the items were passed to the constructor. Pass `Coordinates` to
+		skip the conversion in the UI thread
+		"""
+		x, y = self._to_coordinate_lists(points)
+		self._items[item_index].setData(x, y)
+
+	def set_aggregates(self, aggregates: backend.TimePyramid) -> None:
+		"""Replaces the aggregates that were passed to the constructor"""
+		for items in self._aggregate_items.values():
+			for item in items:
+				self.getPlotItem().removeItem(item)
+		self._aggregate_items = {}
+		self._aggregates = aggregates
+
+		# Force the currently shown resolution to be rebuilt
+		self._current_resolution = None
+		for item in self._items: item.setVisible(True)
+		self._update_resolution()
+
+	def _setup_aggregates(self, aggregates: Optional[backend.TimePyramid], color: str) -> None:
+		self._aggregates = aggregates
+		self._aggregates_color = color
+		self._aggregate_items: Dict[str, List[pg.GraphicsObject]] = {} # Built on first use
+		self._current_resolution: Optional[str] = None # None means individual scores
+
+		if aggregates:
+			assert self._datetime_x_axis, "Aggregates require a datetime x axis"
+			# Resizing changes the pixels per day too, and doesn't change the range unless auto-range is on
+			view_box = self.getPlotItem().vb
+			view_box.sigXRangeChanged.connect(lambda *args: self._update_resolution())
+			view_box.sigResized.connect(lambda *args: self._update_resolution())
+			self._update_resolution()
+
+	def _update_resolution(self) -> None:
+		if not self._aggregates: return
+
+		view_box = self.getPlotItem().vb
+		(x_min, x_max), _ = view_box.viewRange()
+		seconds_per_pixel = (x_max - x_min) / max(view_box.width(), 1)
+
+		resolution: Optional[str]
+		if globals.SECONDS_PER_DAY / seconds_per_pixel >= RAW_MIN_PIXELS_PER_DAY:
+			resolution = None
+		else:
+			# Fall back to the coarsest resolution if even that one's too crowded
+			resolution = AGGREGATE_RESOLUTIONS[-1][0]
+			for name, bucket_seconds in AGGREGATE_RESOLUTIONS:
+				if bucket_seconds / seconds_per_pixel >= AGGREGATE_MIN_PIXELS_PER_BUCKET:
+					resolution = name
+					break
+
+		if resolution == self._current_resolution: return
+		self._current_resolution = resolution
+
+		if resolution and resolution not in self._aggregate_items:
+			bucket_seconds = dict(AGGREGATE_RESOLUTIONS)[resolution]
+			items = self._make_aggregate_items(getattr(self._aggregates, resolution), bucket_seconds)
+			for item in items:
+				self.getPlotItem().addItem(item)
+			self._aggregate_items[resolution] = items
+
+		# Hidden items aren't drawn, so the drawing cost only depends on the visible resolution. Only
+		# the scatter items are replaced by aggregates, line items like trend lines stay visible
+		for item in self._items:
+			if isinstance(item, pg.ScatterPlotItem):
+				item.setVisible(resolution is None)
+		for name, items in self._aggregate_items.items():
+			for item in items:
+				item.setVisible(name == resolution)
+
+	# Draws the median as a line, surrounded by bands for the interquartile range and for min-max
+	def _make_aggregate_items(self,
+		aggregates: backend.TimeAggregates,
+		bucket_seconds: float,
+	) -> List[pg.GraphicsObject]:
+		# Place each point in the middle of its bucket
+		x = [start.timestamp() + bucket_seconds / 2 for start in aggregates.starts]
+
+		items: List[pg.GraphicsObject] = []
+		for lower, upper, alpha in [(aggregates.mins, aggregates.maxs, 0.1), (aggregates.p25s, aggregates.p75s, 0.3)]:
+			band_color = pg.mkColor(self._aggregates_color)
+			band_color.setAlphaF(alpha)
+			lower_curve = pg.PlotCurveItem(x, lower, pen=None)
+			upper_curve = pg.PlotCurveItem(x, upper, pen=None)
+			items += [lower_curve, upper_curve, pg.FillBetweenItem(lower_curve, upper_curve, brush=band_color)]
+		items.append(pg.PlotCurveItem(x, aggregates.medians, pen=pg.mkPen(self._aggregates_color, width=2)))
+
+		return items
+
 	def _setup_crosshair(self,
 		show_x_crosshair: bool,
 		crosshair_move_callback: Callable[[X], None] = lambda x: None,
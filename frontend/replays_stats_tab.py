@@ -0,0 +1,101 @@
+from __future__ import annotations
+from typing import *
+
+import logging
+
+from PyQt5.QtWidgets import QWidget, QGridLayout, QLabel, QProgressBar
+
+import backend
+from plot_wrapper import PlotWrapper, PlotItem, LinePlotItem
+from loading_bar import run_in_background, returning_exceptions
+
+
+OFFSET_COLOR = "1f77b4"
+OFFSET_MEDIAN_COLOR = "ffffff"
+OFFSET_QUARTILES_COLOR = "888888"
+
+class OffsetHistogram(PlotWrapper):
+	def __init__(self):
+		super().__init__(
+			item=PlotItem(data=LinePlotItem(points=[], width=2), color=OFFSET_COLOR),
+			title="Hit offset distribution (ms)",
+		)
+
+	def show_analysis(self, analysis: backend.ReplaysAnalysis) -> None:
+		self.set_data(0, analysis.offset_histogram)
+
+class OffsetOverTime(PlotWrapper):
+	def __init__(self):
+		super().__init__(
+			item=[
+				PlotItem(data=LinePlotItem(points=[], width=2), color=OFFSET_MEDIAN_COLOR,
+					legend_name="Median"),
+				PlotItem(data=LinePlotItem(points=[]), color=OFFSET_QUARTILES_COLOR,
+					legend_name="25th and 75th percentile"),
+				PlotItem(data=LinePlotItem(points=[]), color=OFFSET_QUARTILES_COLOR),
+			],
+			title="Hit offset over time (ms)",
+			datetime_x_axis=True,
+			show_x_crosshair=True,
+		)
+
+	def show_analysis(self, analysis: backend.ReplaysAnalysis) -> None:
+		self.set_data(0, analysis.offset_median_over_time)
+		self.set_data(1, analysis.offset_p25_over_time)
+		self.set_data(2, analysis.offset_p75_over_time)
+
+class ReplaysStatsTab(QWidget):
+	"""
+	Analyses the replays in a background thread. The plots are filled in progressively while the
+	partial results come in
+	"""
+
+	def __init__(self,
+		replays_dir: str,
+		xml_stats: backend.XmlStats,
+		finished_callback: Callable[[backend.ReplaysAnalysis], None],
+	):
+		super().__init__()
+
+		self._finished_callback = finished_callback
+
+		self._progress_bar = QProgressBar()
+		self._summary = QLabel()
+		self._offset_histogram = OffsetHistogram()
+		self._offset_over_time = OffsetOverTime()
+
+		layout = QGridLayout()
+		self.setLayout(layout)
+		layout.addWidget(self._progress_bar, 0, 0, 1, 2)
+		layout.addWidget(self._summary, 1, 0, 1, 2)
+		layout.addWidget(self._offset_histogram, 2, 0)
+		layout.addWidget(self._offset_over_time, 2, 1)
+
+		@returning_exceptions
+		def task(*args) -> backend.ReplaysAnalysis:
+			return backend.load_replays_analysis(replays_dir, xml_stats, *args)
+
+		self._summary.setText("Analysing replays...")
+		# Saved from GC while running
+		self._background_task: Optional[Tuple[Any, Any]] = run_in_background(task, self._progress_bar,
+			self._show_analysis, self._loading_finished)
+
+	def _show_analysis(self, analysis: backend.ReplaysAnalysis) -> None:
+		self._offset_histogram.show_analysis(analysis)
+		self._offset_over_time.show_analysis(analysis)
+		self._summary.setText(f"{analysis.num_replays} replays analysed, {analysis.num_misses} misses")
+
+	def _loading_finished(self, analysis: Union[backend.ReplaysAnalysis, Exception]) -> None:
+		self._background_task = None
+		self._progress_bar.hide()
+
+		if isinstance(analysis, Exception):
+			logging.warning(f"Couldn't analyse replays: {analysis}")
+			self._summary.setText(f"Couldn't analyse replays: {analysis}")
+			return
+
+		self._show_analysis(analysis)
+		if analysis.num_unreadable_replays > 0:
+			self._summary.setText(self._summary.text()
+				+ f" ({analysis.num_unreadable_replays} replays couldn't be read)")
+		self._finished_callback(analysis)
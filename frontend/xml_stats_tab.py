@@ -2,6 +2,7 @@ from __future__ import annotations
 from typing import *
 
 from datetime import datetime, date
+from dataclasses import dataclass
 
 from PyQt5.QtWidgets import QPushButton, QApplication, QMainWindow, QTabWidget, QLabel, QMessageBox
 from PyQt5.QtWidgets import QWidget, QGridLayout, QVBoxLayout, QRadioButton, QFrame, QDialog
@@ -9,11 +10,25 @@ from PyQt5.QtWidgets import QDialogButtonBox, QLineEdit, QStyle, QHBoxLayout, QC
 
 import backend, globals
 from plot_wrapper import PlotWrapper, ScatterPlotItem, PlotItem, LinePlotItem, LinkGroup
+from plot_wrapper import Coordinates, to_coordinates
 from loading_bar import blocking_loading_bar
 
 
 # Color for the all-grades-considered accuracy rating over time
 ALL_GRADES_COLOR = "ffffff"
+ACCURACY_COLOR = "1f77b4"
+ROLLING_MEDIAN_COLOR = "ff7f0e"
+ROLLING_MEAN_COLOR = "2ca02c"
+# Number of most recent scores that the accuracy trend lines are calculated over
+ROLLING_WINDOW_SCORES = 50
+# Color and legend name of the score rating series of each grade
+GRADE_SERIES = [
+	(globals.AAAA_COLOR, "AAAA and above"),
+	(globals.AAA_COLOR, "AAA"),
+	(globals.AA_COLOR, "AA"),
+	(globals.A_COLOR, "A"),
+	(globals.B_COLOR, "B and below"),
+]
 
 def vertical_separator() -> QWidget:
 	line = QFrame()
@@ -21,6 +36,60 @@ def vertical_separator() -> QWidget:
 	line.setFrameShadow(QFrame.Sunken)
 	return line
 
+def ssrs_by_grade(ssr_over_time: backend.SsrOverTime) -> List[List[Tuple[datetime, float]]]:
+	"""Returns the series in the order of GRADE_SERIES"""
+	return [ssr_over_time.aaaa_and_above, ssr_over_time.aaa, ssr_over_time.aa, ssr_over_time.a,
+		ssr_over_time.b_and_below]
+
+@dataclass
+class XmlStatsPlotData:
+	"""
+	The series of the XML stats plots, converted to plot coordinates. The backend converts its
+	series on every access and the coordinates need a timestamp per point, which is the slow part of
+	building the plots, so this can be prepared in a background thread
+	"""
+	stats: backend.XmlStats
+	skillsets_over_time: List[Tuple[datetime, List[float]]] # For the crosshair text
+	skillset_coordinates: List[Coordinates] # In the order of globals.SKILLSET_NAMES_8
+	rolling_acc_median: Coordinates
+	rolling_acc_mean: Coordinates
+	# The individual scores are only needed to build the plots from scratch. None if left out
+	ssrs_by_grade: Optional[List[Coordinates]]
+	accs: Optional[Coordinates]
+
+	@staticmethod
+	def prepare(stats: backend.XmlStats, include_scores: bool = True) -> XmlStatsPlotData:
+		skillsets_over_time = stats.skillsets_over_time
+		rolling_acc = stats.rolling_stats("accuracy", window_scores=ROLLING_WINDOW_SCORES)
+
+		ssrs: Optional[List[Coordinates]] = None
+		accs: Optional[Coordinates] = None
+		if include_scores:
+			ssrs = [to_coordinates(grade_ssrs, datetime_x_axis=True)
+				for grade_ssrs in ssrs_by_grade(stats.ssr_over_time)]
+			accs = to_coordinates(stats.acc_over_time, datetime_x_axis=True)
+
+		return XmlStatsPlotData(
+			stats=stats,
+			skillsets_over_time=skillsets_over_time,
+			skillset_coordinates=[
+				to_coordinates([(dt, rating[i]) for dt, rating in skillsets_over_time], datetime_x_axis=True)
+				for i in range(8)
+			],
+			rolling_acc_median=to_coordinates(rolling_acc.median, datetime_x_axis=True),
+			rolling_acc_mean=to_coordinates(rolling_acc.mean, datetime_x_axis=True),
+			ssrs_by_grade=ssrs,
+			accs=accs,
+		)
+
+@dataclass
+class PreparedXmlStatsUpdate:
+	"""An XmlStatsUpdate along with the plot data that XmlStatsTab.apply_update needs"""
+	update: backend.XmlStatsUpdate
+	plot_data: XmlStatsPlotData
+	new_ssrs_by_grade: List[Coordinates]
+	new_accs: Coordinates
+
 T = TypeVar("T")
 def find_rating_at(target_dt: datetime, ratings: List[Tuple[datetime, T]]) -> Optional[T]:
 	try:
@@ -29,11 +98,15 @@ def find_rating_at(target_dt: datetime, ratings: List[Tuple[datetime, T]]) -> Op
 		return None # Cursor is before first rating
 
 class SkillsetsOverTime(QWidget):
-	def __init__(self, stats: backend.XmlStats, link_group: LinkGroup):
+	def __init__(self, plot_data: XmlStatsPlotData, link_group: LinkGroup):
 		super().__init__()
-		self._stats = stats
+		self._stats = plot_data.stats
+		self._skillsets_over_time = plot_data.skillsets_over_time
+		self._skillset_coordinates = plot_data.skillset_coordinates
 		self._acc_rating_over_time: Optional[Any] = None # Will be calculated on-demand
+		self._acc_rating_stats: Optional[backend.XmlStats] = None # Stats that acc ratings are based on
 		self._link_group = link_group
+		self._display_index = 0
 
 		self._layout = QVBoxLayout()
 		self.setLayout(self._layout)
@@ -72,9 +145,20 @@ class SkillsetsOverTime(QWidget):
 		self._layout.replaceWidget(self._plot, new_plot)
 		self._plot = new_plot
 		self._layout.invalidate() # Causes glitches otherwise
+		self._display_index = index
+
+	def update_stats(self, plot_data: XmlStatsPlotData) -> None:
+		self._stats = plot_data.stats
+		self._skillsets_over_time = plot_data.skillsets_over_time
+		self._skillset_coordinates = plot_data.skillset_coordinates
+
+		# The AAA/AAAA ratings are recalculated when the user switches to them the next time
+		if self._display_index == 0:
+			for i in range(8):
+				self._plot.set_data(i, self._skillset_coordinates[i])
 
 	def _crosshair_moved_skillsets(self, cursor_x: datetime) -> None:
-		rating = find_rating_at(cursor_x, self._stats.skillsets_over_time) or [0, 0, 0, 0, 0, 0, 0, 0]
+		rating = find_rating_at(cursor_x, self._skillsets_over_time) or [0, 0, 0, 0, 0, 0, 0, 0]
 
 		text = f"{cursor_x.date()}: "
 		for i in range(8):
@@ -89,7 +173,7 @@ class SkillsetsOverTime(QWidget):
 		plot_items = []
 		for i in range(8):
 			plot_items.append(PlotItem(
-				data=LinePlotItem(points=[(dt, rating[i]) for dt, rating in self._stats.skillsets_over_time]),
+				data=LinePlotItem(points=self._skillset_coordinates[i]),
 				color=globals.SKILLSET_COLORS_8[i],
 				legend_name=globals.SKILLSET_NAMES_8[i],
 			))
@@ -122,7 +206,8 @@ class SkillsetsOverTime(QWidget):
 		self._cursor_pos_span.setText(text)
 
 	def _setup_acc_rating(self) -> PlotWrapper:
-		if not self._acc_rating_over_time:
+		if not self._acc_rating_over_time or self._acc_rating_stats is not self._stats:
+			self._acc_rating_stats = self._stats
 			self._acc_rating_over_time = blocking_loading_bar(
 				lambda *args: backend.calculate_acc_rating_over_time(self._stats, *args),
 				"Calculating accuracy ratings",
@@ -152,55 +237,104 @@ class SkillsetsOverTime(QWidget):
 		)
 
 class ScoreRatingOverTime(PlotWrapper):
-	def __init__(self, stats: backend.XmlStats, link_group: LinkGroup):
+	def __init__(self, plot_data: XmlStatsPlotData, link_group: LinkGroup):
+		assert plot_data.ssrs_by_grade is not None, "Building the plot needs the individual scores"
 		super().__init__(
 			item=[
-				PlotItem(
-					data=ScatterPlotItem(dots=stats.ssr_over_time.aaaa_and_above),
-					color=globals.AAAA_COLOR, legend_name="AAAA and above",
-				),
-				PlotItem(
-					data=ScatterPlotItem(dots=stats.ssr_over_time.aaa),
-					color=globals.AAA_COLOR, legend_name="AAA",
-				),
-				PlotItem(
-					data=ScatterPlotItem(dots=stats.ssr_over_time.aa),
-					color=globals.AA_COLOR, legend_name="AA",
-				),
-				PlotItem(
-					data=ScatterPlotItem(dots=stats.ssr_over_time.a),
-					color=globals.A_COLOR, legend_name="A",
-				),
-				PlotItem(
-					data=ScatterPlotItem(dots=stats.ssr_over_time.b_and_below),
-					color=globals.B_COLOR, legend_name="B and below",
-				),
+				PlotItem(data=ScatterPlotItem(dots=ssrs), color=color, legend_name=name)
+				for ssrs, (color, name) in zip(plot_data.ssrs_by_grade, GRADE_SERIES)
 			],
 			title="Score rating over time",
 			datetime_x_axis=True,
 			show_x_crosshair=True,
 			link_group=link_group,
+			# A single all-grades band instead of one per grade, see XmlStats.ssr_aggregates
+			aggregates=plot_data.stats.ssr_aggregates,
+			aggregates_color=ALL_GRADES_COLOR,
 		)
+	
+	def append_ssrs(self,
+		new_ssrs_by_grade: List[Coordinates],
+		ssr_aggregates: backend.TimePyramid,
+	) -> None:
+		for i, new_ssrs in enumerate(new_ssrs_by_grade):
+			self.append_data(i, new_ssrs)
+		self.set_aggregates(ssr_aggregates)
 
 class AccuracyOverTime(PlotWrapper):
-	def __init__(self, stats: backend.XmlStats, link_group: LinkGroup):
+	def __init__(self, plot_data: XmlStatsPlotData, link_group: LinkGroup):
+		assert plot_data.accs is not None, "Building the plot needs the individual scores"
 		super().__init__(
-			item=PlotItem(data=ScatterPlotItem(dots=stats.acc_over_time), color="#1f77b4"),
+			item=[
+				# Trend lines come first so they're drawn on top of the scores
+				PlotItem(data=LinePlotItem(points=plot_data.rolling_acc_median, width=2),
+					color=ROLLING_MEDIAN_COLOR, legend_name=f"Median of last {ROLLING_WINDOW_SCORES}"),
+				PlotItem(data=LinePlotItem(points=plot_data.rolling_acc_mean, width=2),
+					color=ROLLING_MEAN_COLOR, legend_name=f"Mean of last {ROLLING_WINDOW_SCORES}"),
+				PlotItem(data=ScatterPlotItem(dots=plot_data.accs), color=ACCURACY_COLOR),
+			],
 			title="Accuracy over time",
 			datetime_x_axis=True,
 			show_x_crosshair=True,
 			link_group=link_group,
+			aggregates=plot_data.stats.acc_aggregates,
+			aggregates_color=ACCURACY_COLOR,
 		)
+	
+	def append_accs(self, plot_data: XmlStatsPlotData, new_accs: Coordinates) -> None:
+		self.set_data(0, plot_data.rolling_acc_median)
+		self.set_data(1, plot_data.rolling_acc_mean)
+		self.append_data(2, new_accs)
+		self.set_aggregates(plot_data.stats.acc_aggregates)
 
 class XmlStatsTab(QWidget):
+	stats: backend.XmlStats # Kept up to date on live reload
+
 	def __init__(self, stats: backend.XmlStats):
 		super().__init__()
 
-		layout = QGridLayout()
-		self.setLayout(layout)
+		self.stats = stats
+
+		self._layout = QGridLayout()
+		self.setLayout(self._layout)
+
+		self._setup_plots(XmlStatsPlotData.prepare(stats))
 
+	def _setup_plots(self, plot_data: XmlStatsPlotData) -> None:
 		link_group = LinkGroup()
 
-		layout.addWidget(ScoreRatingOverTime(stats, link_group), 0, 0)
-		layout.addWidget(SkillsetsOverTime(stats, link_group), 0, 1)
-		layout.addWidget(AccuracyOverTime(stats, link_group), 1, 0)
+		self._score_rating_over_time = ScoreRatingOverTime(plot_data, link_group)
+		self._skillsets_over_time = SkillsetsOverTime(plot_data, link_group)
+		self._accuracy_over_time = AccuracyOverTime(plot_data, link_group)
+
+		self._layout.addWidget(self._score_rating_over_time, 0, 0)
+		self._layout.addWidget(self._skillsets_over_time, 0, 1)
+		self._layout.addWidget(self._accuracy_over_time, 1, 0)
+
+	@staticmethod
+	def prepare_update(update: backend.XmlStatsUpdate) -> PreparedXmlStatsUpdate:
+		"""Does the slow part of `apply_update`. Meant to be called in a background thread"""
+		return PreparedXmlStatsUpdate(
+			update=update,
+			# Appending only needs the new scores, so the old ones aren't converted again
+			plot_data=XmlStatsPlotData.prepare(update.stats, include_scores=not update.append_only),
+			new_ssrs_by_grade=[to_coordinates(ssrs, datetime_x_axis=True)
+				for ssrs in ssrs_by_grade(update.new_ssr_over_time)],
+			new_accs=to_coordinates(update.new_acc_over_time, datetime_x_axis=True),
+		)
+
+	def apply_update(self, prepared_update: PreparedXmlStatsUpdate) -> None:
+		"""Brings the plots up to date with the re-read Etterna.xml"""
+		plot_data = prepared_update.plot_data
+		self.stats = plot_data.stats
+		if prepared_update.update.append_only:
+			self._score_rating_over_time.append_ssrs(prepared_update.new_ssrs_by_grade,
+				plot_data.stats.ssr_aggregates)
+			self._accuracy_over_time.append_accs(plot_data, prepared_update.new_accs)
+			self._skillsets_over_time.update_stats(plot_data)
+		else:
+			# Existing scores have changed, so the plots can't be patched and are rebuilt instead
+			for widget in [self._score_rating_over_time, self._skillsets_over_time, self._accuracy_over_time]:
+				self._layout.removeWidget(widget)
+				widget.deleteLater()
+			self._setup_plots(plot_data)
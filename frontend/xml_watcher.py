@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import *
+
+import logging
+
+from PyQt5.QtWidgets import QProgressBar, QStatusBar
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer
+
+import backend
+from loading_bar import run_in_background, returning_exceptions
+from xml_stats_tab import XmlStatsTab, PreparedXmlStatsUpdate
+
+
+# Etterna writes the XML in multiple chunks, so wait until it's been quiet for a while
+DEBOUNCE_MILLISECONDS = 2000
+
+class XmlWatcher(QObject):
+	"""
+	Watches the Etterna.xml for changes and diffs new scores into the XML stats tab. Reading and
+	analysing the XML happens in a background thread, so the UI stays responsive
+	"""
+
+	def __init__(self, stats: backend.XmlStats, xml_stats_tab: XmlStatsTab, status_bar: QStatusBar):
+		super().__init__()
+
+		self._stats = stats
+		self._xml_stats_tab = xml_stats_tab
+		self._status_bar = status_bar
+
+		self._progress_bar = QProgressBar()
+		self._progress_bar.setMaximumWidth(200)
+		self._progress_bar.hide()
+		self._status_bar.addPermanentWidget(self._progress_bar)
+
+		self._background_task: Optional[Tuple[Any, Any]] = None # Saved from GC while running
+		self._reload_pending = False
+		self._enabled = True
+
+		self._debounce_timer = QTimer()
+		self._debounce_timer.setSingleShot(True)
+		self._debounce_timer.setInterval(DEBOUNCE_MILLISECONDS)
+		self._debounce_timer.timeout.connect(self._reload)
+
+		self._watcher = QFileSystemWatcher()
+		self._watcher.fileChanged.connect(self._file_changed)
+		self._watch_xml()
+
+	def set_enabled(self, enabled: bool) -> None:
+		self._enabled = enabled
+		if enabled:
+			self._watch_xml()
+			# Catch up on changes that were made while live reload was off
+			self._debounce_timer.start()
+		else:
+			self._debounce_timer.stop()
+			self._reload_pending = False
+			if self._watcher.files():
+				self._watcher.removePaths(self._watcher.files())
+
+	def _watch_xml(self) -> None:
+		# Etterna replaces the file when saving, which drops it from the watch list, so this needs
+		# to be called again after every change
+		if self._stats.xml_path not in self._watcher.files():
+			self._watcher.addPath(self._stats.xml_path)
+
+	def _file_changed(self, path: str) -> None:
+		self._debounce_timer.start() # Restarts the timer if it's already running
+
+	def _reload(self) -> None:
+		# The file may not have been there when the change was registered, if it was in the middle
+		# of being replaced
+		self._watch_xml()
+
+		if self._background_task:
+			self._reload_pending = True
+			return
+
+		# The file could have been read while Etterna was still writing it, so this can fail
+		@returning_exceptions
+		def task(*args) -> PreparedXmlStatsUpdate:
+			update = backend.update_xml_stats(self._stats, *args)
+			# Converting the plot data is slow too, so that's done here instead of in the UI thread
+			return XmlStatsTab.prepare_update(update)
+
+		self._progress_bar.show()
+		self._background_task = run_in_background(task, self._progress_bar, self._status_bar.showMessage,
+			self._reload_finished)
+
+	def _reload_finished(self, result: Union[PreparedXmlStatsUpdate, Exception]) -> None:
+		self._background_task = None
+		self._progress_bar.hide()
+
+		# Live reload was turned off while this was running
+		if not self._enabled:
+			return
+
+		if isinstance(result, Exception):
+			logging.warning(f"Couldn't reload Etterna.xml: {result}")
+			self._status_bar.showMessage("Couldn't reload Etterna.xml, retrying on next change")
+		else:
+			self._stats = result.update.stats
+			self._xml_stats_tab.apply_update(result)
+			self._status_bar.showMessage("Etterna.xml reloaded", 5000)
+
+		if self._reload_pending:
+			self._reload_pending = False
+			self._debounce_timer.start()